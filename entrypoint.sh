@@ -21,5 +21,12 @@ echo "Seeding initial data..."
 python manage.py seed_data
 
 
+if [ "$SERVER_MODE" = "asgi" ]; then
+  # persistent connections leak under ASGI (a connection per executor thread), see DB_CONN_MAX_AGE
+  export DB_CONN_MAX_AGE="${DB_CONN_MAX_AGE:-0}"
+  echo "Starting Gunicorn with uvicorn workers (ASGI)..."
+  exec gunicorn project.asgi:application -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:8000
+fi
+
 echo "Starting Gunicorn..."
 exec gunicorn project.wsgi:application --bind 0.0.0.0:8000
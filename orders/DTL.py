@@ -2,7 +2,37 @@
 from django.views.generic import TemplateView
 from django.shortcuts import redirect
 from django import forms
-from .models import Product
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.db.models import Avg, Count, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .cache import cached_for_company, invalidate_catalog
+from .models import Company, Order, Product, StockMovement
+from .tenancy import get_tenant
+
+LOW_STOCK = 10
+PAGE_SIZE = 25
+
+def dashboard_stats(company_id):
+    """everything the dashboard cards show, in one query: the company row left joined to its active products,
+    with today's order counts as subqueries on the (company, status, created_at) index"""
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    orders_today = Order.objects.filter(company_id=company_id, created_at__gte=today).order_by()
+    active = Q(products__is_active=True)
+    stats = Company.objects.filter(id=company_id).annotate(
+        product_count=Count('products', filter=active),
+        total_stock=Coalesce(Sum('products__stock', filter=active), 0),
+        price_avg=Avg('products__price', filter=active),
+        low_stock_count=Count('products', filter=active & Q(products__stock__lt=LOW_STOCK)),
+        **{f'orders_{status}': Coalesce(Subquery(
+            orders_today.filter(status=status).values('company_id').annotate(n=Count('id')).values('n')
+        ), 0) for status, _ in Order.STATUS_CHOICES},
+    ).values('product_count', 'total_stock', 'price_avg', 'low_stock_count',
+             *(f'orders_{status}' for status, _ in Order.STATUS_CHOICES)).get()
+    stats['orders_today'] = {status: stats.pop(f'orders_{status}') for status, _ in Order.STATUS_CHOICES}
+    return stats
 
 class ProductForm(forms.ModelForm):
     class Meta:
@@ -15,11 +45,7 @@ class IndexView(TemplateView):
     def get(self, request,*a,**k):
         if not request.user.is_authenticated:
             return redirect('admin/login/')
-        form = ProductForm()
-        products = Product.active_objects.filter(company=request.user.company)
-        total_stock = sum(p.stock for p in products)
-        avg = total_stock / products.count() if products.exists() else 0
-        return self.render_to_response({'form':form,'total_stock':total_stock,'price_avg': avg ,'products':products})
+        return self.render_dashboard(ProductForm())
 
 
     def post(self, request,*a,**k):
@@ -29,11 +55,32 @@ class IndexView(TemplateView):
         form = ProductForm(request.POST)
         if form.is_valid():
             p = form.save(commit=False)
-            p.company = request.user.company
+            p.company_id = get_tenant(request).company_id
             p.created_by = request.user
-            p.save()
+            with transaction.atomic():
+                p.save()
+                StockMovement.record_many('opening', [
+                    {'company_id': p.company_id, 'product_id': p.pk, 'delta': p.stock}
+                ])
+            invalidate_catalog(p.company_id)
             return redirect('index')
-        products = Product.active_objects.filter(company=request.user.company)
-        total_stock = sum(p.stock for p in products)
-        avg = total_stock / products.count() if products.exists() else 0
-        return self.render_to_response({'form':form,'total_stock':total_stock,'price_avg': avg ,'products':products})
+        return self.render_dashboard(form)
+
+    def render_dashboard(self, form):
+        company_id = get_tenant(self.request).company_id
+        # stats and product pages are cached with the catalog, so any product write refreshes them
+        stats = cached_for_company(
+            company_id, 'dashboard', lambda: dashboard_stats(company_id), settings.DASHBOARD_CACHE_TTL
+        )
+
+        paginator = Paginator(
+            Product.active_objects.for_tenant(get_tenant(self.request)).order_by('name', 'id'), PAGE_SIZE
+        )
+        paginator.count = stats['product_count'] # already counted by the aggregate
+        page = paginator.get_page(self.request.GET.get('page'))
+        products = cached_for_company(
+            company_id, f'dashboard:page:{page.number}',
+            lambda: list(page.object_list.values('name', 'price', 'stock', 'last_updated_at'))
+        )
+
+        return self.render_to_response({'form':form, 'products':products, 'page':page, 'low_stock':LOW_STOCK, **stats})
@@ -1,14 +1,109 @@
-from django.contrib import admin
+from collections import defaultdict
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connection
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
 from django.utils import timezone
-from .models import Order, Product, Company, User
-from .utils import export_order_util
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .authentication import revoke_token
+from .models import ApiToken, ExportJob, Order, Product, Company, StockMovement, User
+from .cache import invalidate_catalog
+from .exports import EXPORT_FILTERS, download, queue_export
+from .tenancy import get_tenant
+
+
+def estimated_rows(model):
+    """row count from the table statistics (InnoDB's estimate, no scan), None where there are none"""
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    never COUNT(*)s more than ADMIN_EXACT_COUNT_LIMIT rows: counting stops at the limit, and past it
+    an unfiltered changelist shows the table estimate while a filtered one pages up to the limit
+    """
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        capped = self.object_list[:limit + 1].count() # SELECT COUNT(*) FROM (... LIMIT n), stops early
+        if capped <= limit:
+            return capped
+        estimate = None if self.object_list.query.where else estimated_rows(self.object_list.model)
+        return max(estimate, capped) if estimate else limit
+
+
+class TenantAdmin(admin.ModelAdmin):
+    """staff who aren't superusers only see (and act on) their own company's rows"""
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(company_id=get_tenant(request).company_id)
+
+    def get_list_filter(self, request):
+        # the company filter would list every tenant's name
+        filters = super().get_list_filter(request)
+        if request.user.is_superuser:
+            return filters
+        return tuple(f for f in filters if f != 'company')
+
+    def get_readonly_fields(self, request, obj=None):
+        fields = super().get_readonly_fields(request, obj)
+        if request.user.is_superuser or 'company' in fields:
+            return fields
+        return (*fields, 'company')
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        # a raw id typed in by hand is validated against this queryset too
+        model = db_field.related_model
+        if not request.user.is_superuser and any(f.name == 'company' for f in model._meta.fields):
+            kwargs['queryset'] = model._default_manager.filter(company_id=get_tenant(request).company_id)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if not change and not request.user.is_superuser:
+            obj.company_id = get_tenant(request).company_id
+        super().save_model(request, obj, form, change)
+
 
 @admin.action(description='Delete selected products')
 def mark_products_inactive(modeladmin, request, queryset):
+    company_ids = set(queryset.values_list('company_id', flat=True).distinct())
     queryset.update(is_active=False, last_updated_at=timezone.now())
+    invalidate_catalog(*company_ids)
 
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(TenantAdmin):
     actions = [mark_products_inactive]
+    list_display = ('name', 'company', 'price', 'stock', 'is_active', 'last_updated_at')
+    list_select_related = ('company',)
+    list_filter = ('is_active', 'company')
+    search_fields = ('^name',) # prefix match, uses the name index
+    raw_id_fields = ('company',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def save_model(self, request, obj, form, change):
+        before = 0
+        if change: # the change view runs in a transaction, so the lock holds until the save commits
+            before = Product.objects.select_for_update().values_list('stock', flat=True).get(pk=obj.pk)
+        super().save_model(request, obj, form, change)
+        StockMovement.record_many('adjustment' if change else 'opening', [
+            {'company_id': obj.company_id, 'product_id': obj.pk, 'delta': obj.stock - before}
+        ])
+        invalidate_catalog(obj.company_id, form.initial.get('company'))
 
     def get_actions(self, request):
         actions = super().get_actions(request)
@@ -18,12 +113,111 @@ class ProductAdmin(admin.ModelAdmin):
 
 @admin.action(description='Export selected orders as CSV')
 def export_orders_as_csv(modeladmin, request, queryset):
-    return export_order_util(queryset)
+    # written in the background by run_export_jobs, one file per company, see Export jobs.
+    # "select all" stores the changelist's filters, however many orders they match; a plain
+    # selection is one page of ids at most
+    if request.POST.get('select_across') == '1':
+        # a search or hand typed lookup the job can't repeat would export more than was listed
+        unsupported = sorted(
+            key for key, value in request.GET.items() if value and key not in EXPORT_FILTERS and key not in ('o', 'p')
+        )
+        if unsupported:
+            modeladmin.message_user(
+                request, f"Can't export all orders matching {', '.join(unsupported)}, select them on the page instead",
+                messages.ERROR,
+            )
+            return
+        filters = {key: request.GET[key] for key in EXPORT_FILTERS if key in request.GET}
+        by_company = {
+            company_id: filters
+            for company_id in queryset.order_by().values_list('company_id', flat=True).distinct()
+        }
+    else:
+        by_company = defaultdict(lambda: {'id__in': []})
+        for order_id, company_id in queryset.values_list('id', 'company_id'):
+            by_company[company_id]['id__in'].append(order_id)
+    for company_id, filters in by_company.items():
+        queue_export(company_id, request.user, filters=filters)
+    modeladmin.message_user(request, f"{len(by_company)} export(s) queued, download them from Export jobs")
+
+@admin.action(description='Mark selected orders as success')
+def mark_orders_success(modeladmin, request, queryset):
+    moved = queryset.transition('success')
+    modeladmin.message_user(request, f"{moved} order(s) marked as success")
+
+@admin.action(description='Mark selected orders as failed')
+def mark_orders_failed(modeladmin, request, queryset):
+    moved = queryset.transition('failed')
+    modeladmin.message_user(request, f"{moved} order(s) marked as failed")
+
+class OrderAdmin(TenantAdmin):
+    actions = [export_orders_as_csv, mark_orders_success, mark_orders_failed]
+    list_display = ('id', 'product', 'company', 'quantity', 'status', 'created_by', 'created_at')
+    list_select_related = ('product', 'company', 'created_by') # __str__ and the columns read them
+    # status and company seek on the (status|company, created_at) indexes, with the date range applied
+    # inside them; a date range on its own has no index leading with created_at and scans
+    list_filter = ('status', 'company', ('created_at', admin.DateFieldListFilter))
+    raw_id_fields = ('company', 'product')
+    readonly_fields = ('created_by', 'created_at')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False # no second COUNT(*) of the whole table next to the filtered one
+
+    def get_object(self, request, object_id, from_field=None):
+        obj = super().get_object(request, object_id, from_field)
+        if obj is not None and request.method == 'POST':
+            # the change form POST is one transaction: re-read under a row lock, so save() diffs the
+            # rollups and the success notification against the row as it is now
+            obj = Order.objects.select_for_update().get(pk=obj.pk)
+        return obj
+
+@admin.action(description='Revoke selected tokens')
+def revoke_tokens(modeladmin, request, queryset):
+    for key in queryset.filter(revoked_at__isnull=True).values_list('key', flat=True):
+        revoke_token(key)
+
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ('user', 'key', 'created_at', 'revoked_at')
+    list_select_related = ('user',)
+    readonly_fields = ('key', 'user', 'created_at', 'revoked_at')
+    actions = [revoke_tokens]
+
+    def get_queryset(self, request):
+        # staff who aren't superusers only see (and revoke) the tokens of their own company's users
+        queryset = super().get_queryset(request)
+        if request.user.is_superuser:
+            return queryset
+        return queryset.filter(user__company_id=get_tenant(request).company_id)
+
+    def has_add_permission(self, request):
+        return False # tokens are issued through /api/auth/token/
+
+class ExportJobAdmin(TenantAdmin):
+    list_display = ('id', 'company', 'status', 'rows', 'size', 'created_at', 'finished_at', 'download_link')
+    list_filter = ('status',)
+    list_select_related = ('company',)
+    readonly_fields = [field.name for field in ExportJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False # queued from the orders list or POST /api/orders/exports/
+
+    def get_urls(self):
+        return [
+            path('<uuid:job_id>/download/', self.admin_site.admin_view(self.download_view),
+                 name='orders_exportjob_download'),
+        ] + super().get_urls()
+
+    def download_view(self, request, job_id):
+        return download(request, get_object_or_404(self.get_queryset(request), pk=job_id, status='done'))
 
-class OrderAdmin(admin.ModelAdmin):
-    actions = [export_orders_as_csv]
+    @admin.display(description='File')
+    def download_link(self, job):
+        if job.status != 'done':
+            return '-'
+        return format_html('<a href="{}">{}</a>', reverse('admin:orders_exportjob_download', args=[job.pk]), job.filename)
 
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Order, OrderAdmin)
 admin.site.register(Company)
 admin.site.register(User)
+admin.site.register(ApiToken, ApiTokenAdmin)
+admin.site.register(ExportJob, ExportJobAdmin)
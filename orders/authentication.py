@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+import uuid
+
+from .cache import LRUCache
+from .models import ApiToken, User
+
+SALT = 'orders.api-token'
+
+# jti -> in-memory User built from the claims, so a hit costs neither a session nor a user query
+verified_tokens = LRUCache(settings.API_TOKEN_CACHE_SIZE, settings.API_TOKEN_CACHE_TTL)
+
+
+def issue_token(user):
+    """create a revocable signed token carrying the user's id, company and role"""
+    token = ApiToken.objects.create(key=uuid.uuid4().hex, user=user)
+    return signing.dumps(
+        {'jti': token.key, 'uid': user.pk, 'username': user.username, 'cid': user.company_id, 'role': user.role},
+        salt=SALT,
+    )
+
+
+def read_claims(raw):
+    try:
+        return signing.loads(raw, salt=SALT, max_age=settings.API_TOKEN_MAX_AGE)
+    except signing.SignatureExpired:
+        raise AuthenticationFailed("Token expired")
+    except signing.BadSignature:
+        raise AuthenticationFailed("Invalid token")
+
+
+def revoke_token(jti):
+    """revoke and evict from this process' cache (other processes drop it within API_TOKEN_CACHE_TTL)"""
+    ApiToken.objects.filter(key=jti, revoked_at__isnull=True).update(revoked_at=timezone.now())
+    verified_tokens.delete(jti)
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authorization: Bearer <token>
+
+    The signature is checked on every request (HMAC, no I/O). The first time a token is seen
+    one query makes sure it isn't revoked and the user is still active with the same company
+    and role; after that the verified user comes from an in-process LRU/TTL cache.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed("Invalid token header")
+
+        try:
+            raw = auth[1].decode()
+        except UnicodeDecodeError:
+            raise AuthenticationFailed("Invalid token header")
+        claims = read_claims(raw)
+        user = verified_tokens.get(claims['jti'])
+        if user is None:
+            valid = ApiToken.objects.filter(
+                key=claims['jti'], revoked_at__isnull=True,
+                user_id=claims['uid'], user__is_active=True,
+                user__company_id=claims['cid'], user__role=claims['role'],
+            ).exists()
+            if not valid:
+                raise AuthenticationFailed("Token revoked")
+            user = User(
+                id=claims['uid'], username=claims['username'], company_id=claims['cid'],
+                role=claims['role'], is_active=True,
+            )
+            verified_tokens.set(claims['jti'], user)
+        return user, claims
+
+    def authenticate_header(self, request):
+        return self.keyword
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+import hashlib
+import threading
+import time
+
+from .models import Product
+from .fast_serializers import fast_products
+from .profiling import timed
+
+
+class LRUCache:
+    """
+    small thread-safe in-process LRU with a per-entry TTL, for hot lookups that must not
+    cost a network round trip. entries live in one process only, so keep the TTL short.
+    """
+
+    def __init__(self, maxsize=10_000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def catalog_cache():
+    return caches[settings.PRODUCT_CATALOG_CACHE]
+
+
+def _version_key(company_id):
+    return f'catalog:{company_id}:version'
+
+
+def catalog_version(company_id):
+    """
+    current catalog version of a company. a missing version starts from the clock
+    (not from 1) so an evicted version key can never resurrect an old cached body.
+    """
+    cache = catalog_cache()
+    version = cache.get(_version_key(company_id))
+    if version is None:
+        cache.add(_version_key(company_id), time.time_ns(), None)
+        version = cache.get(_version_key(company_id))
+    return version
+
+
+def invalidate_catalog(*company_ids):
+    """
+    Bump the catalog version of every given company once the current transaction commits,
+    so nobody can re-cache the catalog from rows that are about to change.
+    """
+    company_ids = {cid for cid in company_ids if cid is not None}
+    if not company_ids:
+        return
+
+    def bump():
+        cache = catalog_cache()
+        for company_id in company_ids:
+            try:
+                cache.incr(_version_key(company_id))
+            except ValueError: # no version yet, nothing cached to throw away
+                pass
+
+    transaction.on_commit(bump)
+
+
+def cached_for_company(company_id, name, builder, timeout=None):
+    """
+    cache ``builder()`` under the company's current catalog version, so anything derived
+    from its products goes stale together with the catalog itself.
+    """
+    cache = catalog_cache()
+    key = f'catalog:{company_id}:{catalog_version(company_id)}:{name}'
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, settings.PRODUCT_CATALOG_TTL if timeout is None else timeout)
+    return value
+
+
+def build_catalog(company_id):
+    """returns (etag, json bytes) of the company's active products"""
+    products = Product.active_objects.filter(company_id=company_id)
+    with timed('serializer'):
+        body = fast_products.render(fast_products.values(products))
+    return f'"{hashlib.md5(body).hexdigest()}"', body
+
+
+def get_catalog(company_id):
+    """build_catalog, serializing only on a cache miss"""
+    return cached_for_company(company_id, 'products', lambda: build_catalog(company_id))
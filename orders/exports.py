@@ -0,0 +1,216 @@
+"""
+Background order exports: a job is queued by the API (or the admin), the run_export_jobs worker
+writes its file chunk by chunk, and the client downloads it with HTTP Range so a dropped
+download resumes where it stopped. Full exports walk the company's orders by (created_at, id)
+keyset; "since last" exports start where the previous finished export of the company ended.
+Files are deleted EXPORT_RETENTION_SECONDS after they were written (expire_exports).
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+import gzip
+import logging
+import os
+import re
+
+from .formats import ENCODERS, EXPORT_FIELDS, encode_chunks, get_encoder
+from .models import ExportJob, Order
+from .utils import EXPORT_CHUNK_SIZE
+
+logger = logging.getLogger('orders.exports')
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+
+# Order lookups a job may be narrowed by: the admin changelist's filters, or one page of ids
+EXPORT_FILTERS = ('status__exact', 'product__id__exact', 'created_at__gte', 'created_at__lt', 'id__in')
+
+
+def queue_export(company_id, user, fmt='csv', compress=False, since_last=False, filters=None):
+    """
+    queue an export of the company's orders created until EXPORT_SETTLE_SECONDS ago, so an
+    order whose transaction commits late is still picked up by the next "since last" export.
+    ``filters`` narrows it to the orders matching them now (any age). raises ValueError for a
+    format this server can't write or a filter it doesn't take.
+    """
+    get_encoder(fmt)
+    unknown = set(filters or ()) - set(EXPORT_FILTERS)
+    if unknown:
+        raise ValueError(f"Can't filter exports by {', '.join(sorted(unknown))}")
+    created_after = None
+    if since_last:
+        # only a finished export has written everything up to its created_before; a queued or
+        # running one may still fail, so the next export starts after the last finished one
+        created_after = (
+            ExportJob.objects.filter(company_id=company_id, filters__isnull=True, status__in=('done', 'expired'))
+            .order_by('-created_at').values_list('created_before', flat=True).first()
+        )
+    created_before = timezone.now()
+    if not filters:
+        created_before -= timedelta(seconds=settings.EXPORT_SETTLE_SECONDS)
+    return ExportJob.objects.create(
+        company_id=company_id, created_by=user, format=fmt, gzip=compress, filters=filters or None,
+        created_after=created_after, created_before=created_before,
+    )
+
+
+def export_path(job):
+    return os.path.join(settings.EXPORT_ROOT, job.filename)
+
+
+def job_chunks(job, chunk_size=EXPORT_CHUNK_SIZE):
+    """EXPORT_FIELDS tuples of the job's orders, one list per query"""
+    orders = (
+        Order.objects.filter(company_id=job.company_id, created_at__lt=job.created_before, **(job.filters or {}))
+        .values_list(*EXPORT_FIELDS).order_by('created_at', 'id')
+    )
+    if job.created_after:
+        orders = orders.filter(created_at__gte=job.created_after)
+    page = orders
+    while True:
+        chunk = list(page[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id, last_created_at = chunk[-1][0], chunk[-1][5]
+        page = orders.filter(Q(created_at__gt=last_created_at) | Q(created_at=last_created_at, id__gt=last_id))
+
+
+def claim_job():
+    """
+    the oldest queued job (or one whose worker died), marked running. SKIP LOCKED lets
+    several workers claim side by side.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    with transaction.atomic():
+        job = (
+            ExportJob.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='queued') | Q(status='running', started_at__lt=stale))
+            .order_by('created_at').first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+    return job
+
+
+def write_export(job, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    write the job's file one chunk at a time in its format. with gzip every chunk is its own
+    gzip member, the concatenation is still one valid .gz file and memory stays at one chunk.
+    """
+    compress = gzip.compress if job.gzip else bytes
+    os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+    rows = 0
+
+    def counted(chunks):
+        nonlocal rows
+        for chunk in chunks:
+            yield chunk
+            rows += len(chunk)
+
+    try:
+        with open(export_path(job), 'wb') as out:
+            for block in encode_chunks(get_encoder(job.format), counted(job_chunks(job, chunk_size))):
+                if block:
+                    out.write(compress(block))
+                ExportJob.objects.filter(pk=job.pk).update(rows=rows, size=out.tell()) # progress for pollers
+            size = out.tell()
+    except Exception as exc:
+        logger.exception("export job %s failed", job.pk)
+        ExportJob.objects.filter(pk=job.pk).update(status='failed', error=repr(exc), finished_at=timezone.now())
+        return False
+    ExportJob.objects.filter(pk=job.pk).update(status='done', rows=rows, size=size, finished_at=timezone.now())
+    return True
+
+
+def expire_exports(now=None):
+    """
+    delete the files of exports finished more than EXPORT_RETENTION_SECONDS ago: done jobs
+    become expired (kept, since_last still starts after them), failed jobs go entirely.
+    returns (expired, deleted failed) job counts.
+    """
+    cutoff = (now or timezone.now()) - timedelta(seconds=settings.EXPORT_RETENTION_SECONDS)
+    done = list(ExportJob.objects.filter(status='done', finished_at__lt=cutoff).only('pk', 'format', 'gzip'))
+    failed = list(ExportJob.objects.filter(status='failed', finished_at__lt=cutoff).only('pk', 'format', 'gzip'))
+    for job in done + failed:
+        try:
+            os.remove(export_path(job))
+        except FileNotFoundError: # a job can fail before its file is opened
+            pass
+    expired = ExportJob.objects.filter(pk__in=[job.pk for job in done]).update(status='expired')
+    ExportJob.objects.filter(pk__in=[job.pk for job in failed]).delete()
+    return expired, len(failed)
+
+
+def byte_range(header, size):
+    """
+    (start, end) of a single ``bytes=a-b`` Range header, start > end when it can't be
+    satisfied, None when there is none or it is malformed (RFC 9110: ignore it, send it all)
+    """
+    match = RANGE.match(header)
+    if not match:
+        return None
+    first, last = match.groups()
+    if first:
+        if last and int(last) < int(first):
+            return None
+        return int(first), min(int(last), size - 1) if last else size - 1
+    if last: # bytes=-n, the last n bytes
+        return max(size - int(last), 0), size - 1
+    return None
+
+
+def download(request, job):
+    """
+    the job's file, honouring a single ``Range: bytes=a-b`` (206 / 416) so interrupted
+    downloads resume, and If-Range so a resumed download never mixes two files. 404 when the
+    file is gone (expired after the job was looked up)
+    """
+    try:
+        f = open(export_path(job), 'rb') # the open file outlives a concurrent expire_exports
+    except FileNotFoundError:
+        raise Http404("Export file no longer exists")
+    size = os.fstat(f.fileno()).st_size
+    etag = f'"{job.pk}-{size}"'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Content-Disposition': f'attachment; filename="{job.filename}"',
+    }
+    content_type = 'application/gzip' if job.gzip else ENCODERS[job.format].content_type
+
+    requested = byte_range(request.headers.get('Range', ''), size)
+    if_range = request.headers.get('If-Range')
+    if requested is None or (if_range and if_range != etag):
+        response = FileResponse(
+            f, as_attachment=True, filename=job.filename, content_type=content_type, headers=headers
+        )
+        response['Content-Length'] = size
+        return response
+
+    start, end = requested
+    if start > end:
+        f.close()
+        return HttpResponse(status=416, headers={**headers, 'Content-Range': f'bytes */{size}'})
+
+    def blocks():
+        with f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                block = f.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    return
+                remaining -= len(block)
+                yield block
+
+    response = StreamingHttpResponse(blocks(), status=206, content_type=content_type, headers=headers)
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
@@ -0,0 +1,117 @@
+"""
+Read-only fast path for large responses: the fields of a ModelSerializer are compiled once into
+(name, source, converter) triples, rows come from values_list() tuples (or plain attributes of
+instances already in memory) and JSON is written straight to bytes. The output is byte for byte
+what the ModelSerializer + JSONRenderer produce, see bench_serializers.
+"""
+from decimal import Decimal, getcontext
+from operator import attrgetter
+from rest_framework import serializers
+from rest_framework import ISO_8601
+from rest_framework.settings import api_settings
+import json
+
+from .serializers import OrderSerializer, ProductSerializer
+
+
+def _decimal(field):
+    # DecimalField.to_representation: quantize within max_digits, then a fixed point string
+    quantum = Decimal(1).scaleb(-field.decimal_places)
+    context = getcontext().copy()
+    context.prec = field.max_digits
+    rounding, normalize = field.rounding, field.normalize_output
+    coerce = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+
+    def convert(value):
+        if value is None:
+            return '' if coerce else None
+        value = value.quantize(quantum, rounding=rounding, context=context)
+        if normalize:
+            value = value.normalize()
+        return f'{value:f}' if coerce else float(value)
+    return lambda: convert
+
+
+def _datetime(field):
+    def bind():
+        # DateTimeField.enforce_timezone, with the field's or the active timezone looked up once per call
+        tz = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+
+        def convert(value):
+            if not value:
+                return None
+            value = value.astimezone(tz) if tz is not None and value.tzinfo is not None else field.enforce_timezone(value)
+            text = value.isoformat()
+            return text[:-6] + 'Z' if text.endswith('+00:00') else text
+        return convert
+    return bind
+
+
+def _converter(field):
+    """None when the database value is already right, else a callable that returns the converter"""
+    if isinstance(field, serializers.DecimalField) and field.decimal_places is not None and not field.localize:
+        return _decimal(field)
+    if isinstance(field, serializers.DateTimeField) and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+        return _datetime(field)
+    if isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.BooleanField,
+                          serializers.ChoiceField, serializers.PrimaryKeyRelatedField)):
+        return None # already the right JSON type as it comes from the database
+    raise TypeError(f"{type(field).__name__} has no fast converter")
+
+
+class FastSerializer:
+    """
+    compiled output path of ``serializer_class`` (a ModelSerializer). relations serialize as
+    their pk, so they are read from the FK column and never loaded.
+    """
+
+    def __init__(self, serializer_class):
+        model = serializer_class.Meta.model
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            source = model._meta.get_field(field.source).attname
+            self.fields.append((name, source, _converter(field)))
+        self.sources = [source for _, source, _ in self.fields]
+        self._row = attrgetter(*self.sources)
+        if len(self.sources) == 1: # attrgetter only returns a tuple for two or more names
+            self._row = lambda instance, get=self._row: (get(instance),)
+
+    def values(self, queryset):
+        """the queryset as tuples of exactly the columns the output needs"""
+        return queryset.values_list(*self.sources)
+
+    def data(self, rows):
+        """list of dicts from values() tuples"""
+        names = [name for name, _, _ in self.fields]
+        converters = [(i, bind()) for i, (_, _, bind) in enumerate(self.fields) if bind is not None]
+        data = []
+        for row in rows:
+            row = list(row)
+            for i, convert in converters:
+                row[i] = convert(row[i])
+            data.append(dict(zip(names, row)))
+        return data
+
+    def data_from_instances(self, instances):
+        """same as data(), for model instances that are already loaded (a page, freshly created rows)"""
+        return self.data(map(self._row, instances))
+
+    def render(self, rows):
+        return render_json(self.data(rows))
+
+
+def render_json(data):
+    """JSONRenderer's default output (compact, unicode, U+2028/9 escaped) without the renderer machinery"""
+    text = json.dumps(
+        data,
+        ensure_ascii=not api_settings.UNICODE_JSON,
+        allow_nan=not api_settings.STRICT_JSON,
+        separators=(',', ':') if api_settings.COMPACT_JSON else (', ', ': '),
+    )
+    return text.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+fast_products = FastSerializer(ProductSerializer)
+fast_orders = FastSerializer(OrderSerializer)
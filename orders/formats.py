@@ -0,0 +1,230 @@
+"""
+Encoders for order exports. Every encoder turns one chunk of EXPORT_FIELDS tuples at a time
+into bytes, so the streamed response and the export jobs hold a single chunk in memory
+whatever the format. Arrow and Parquet need pyarrow (in requirements.txt).
+"""
+from django.http import Http404
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+import csv
+import io
+import json
+
+from .models import Order
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError: # only the arrow and parquet formats need it, they answer 400 without it
+    pyarrow = None
+
+STATUS_CODES = {status: code for code, (status, _) in enumerate(Order.STATUS_CHOICES)}
+
+EXPORT_HEADER = ['ID', 'Product', 'Quantity', 'Status', 'Shipped At', 'Created At']
+EXPORT_FIELDS = ('id', 'product__name', 'quantity', 'status', 'shipped_at', 'created_at')
+
+
+def export_row(order_id, product_name, quantity, status, shipped_at, created_at):
+    """one EXPORT_FIELDS tuple as a CSV row"""
+    return [
+        order_id,
+        product_name,
+        quantity,
+        status,
+        shipped_at.isoformat() if shipped_at else '',
+        created_at.isoformat(),
+    ]
+
+
+class CsvEncoder:
+    name = 'csv'
+    extension = 'csv'
+    content_type = 'text/csv'
+
+    def begin(self):
+        return self._write([EXPORT_HEADER])
+
+    def encode(self, chunk):
+        return self._write(export_row(*values) for values in chunk)
+
+    def finish(self):
+        return b''
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+
+
+class NdjsonEncoder:
+    """one JSON object per line, typed: numbers stay numbers, missing shipped_at is null"""
+    name = 'ndjson'
+    extension = 'ndjson'
+    content_type = 'application/x-ndjson'
+
+    def begin(self):
+        return b''
+
+    def encode(self, chunk):
+        return ''.join(
+            json.dumps({
+                'id': order_id, 'product': product, 'quantity': quantity, 'status': status,
+                'shipped_at': shipped_at.isoformat() if shipped_at else None,
+                'created_at': created_at.isoformat(),
+            }) + '\n'
+            for order_id, product, quantity, status, shipped_at, created_at in chunk
+        ).encode()
+
+    def finish(self):
+        return b''
+
+
+class _Sink:
+    """write-only file for pyarrow writers, handing back what was written since the last drain"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.parts.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position # writers record offsets, so this keeps counting across drains
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+class _ArrowEncoder:
+    """one record batch (or Parquet row group) per chunk, columns typed by the schema"""
+
+    def __init__(self):
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.int64()),
+            ('product', pyarrow.string()),
+            ('quantity', pyarrow.int32()),
+            ('status', pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+            ('shipped_at', pyarrow.timestamp('us', tz='UTC')),
+            ('created_at', pyarrow.timestamp('us', tz='UTC')),
+        ])
+        self.statuses = pyarrow.array([status for status, _ in Order.STATUS_CHOICES])
+        self.sink = _Sink()
+        self.writer = None
+
+    def begin(self):
+        self.writer = self.open_writer(pyarrow.PythonFile(self.sink, mode='w'))
+        return self.sink.drain()
+
+    def encode(self, chunk):
+        order_ids, products, quantities, statuses, shipped_at, created_at = zip(*chunk)
+        self.write_batch(pyarrow.RecordBatch.from_arrays([
+            pyarrow.array(order_ids, type=pyarrow.int64()),
+            pyarrow.array(products, type=pyarrow.string()),
+            pyarrow.array(quantities, type=pyarrow.int32()),
+            # the same dictionary in every batch, IPC files allow only one per column
+            pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array([STATUS_CODES[status] for status in statuses], type=pyarrow.int8()), self.statuses
+            ),
+            pyarrow.array(shipped_at, type=pyarrow.timestamp('us', tz='UTC')),
+            pyarrow.array(created_at, type=pyarrow.timestamp('us', tz='UTC')),
+        ], schema=self.schema))
+        return self.sink.drain()
+
+    def finish(self):
+        self.writer.close()
+        return self.sink.drain()
+
+
+class ArrowEncoder(_ArrowEncoder):
+    """Arrow IPC file format (what pandas.read_feather / polars.read_ipc open)"""
+    name = 'arrow'
+    extension = 'arrow'
+    content_type = 'application/vnd.apache.arrow.file'
+
+    def open_writer(self, out):
+        return pyarrow.ipc.new_file(out, self.schema)
+
+    def write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+
+class ParquetEncoder(_ArrowEncoder):
+    name = 'parquet'
+    extension = 'parquet'
+    content_type = 'application/vnd.apache.parquet'
+
+    def open_writer(self, out):
+        return pyarrow.parquet.ParquetWriter(out, self.schema, compression='snappy')
+
+    def write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+
+ENCODERS = {encoder.name: encoder for encoder in (CsvEncoder, NdjsonEncoder, ArrowEncoder, ParquetEncoder)}
+NEEDS_PYARROW = {'arrow', 'parquet'}
+
+
+def get_encoder(name):
+    """a fresh encoder for ``name``, ValueError for unknown formats or a missing pyarrow"""
+    if name not in ENCODERS:
+        raise ValueError(f"Unknown format {name!r}, use one of {', '.join(ENCODERS)}")
+    if name in NEEDS_PYARROW and pyarrow is None:
+        raise ValueError(f"The {name} format needs pyarrow installed on the server")
+    return ENCODERS[name]()
+
+
+def encode_chunks(encoder, chunks):
+    """the whole export as a stream of bytes blocks, one per chunk"""
+    yield encoder.begin()
+    for chunk in chunks:
+        yield encoder.encode(chunk)
+    yield encoder.finish()
+
+
+class ExportRenderer(BaseRenderer):
+    """
+    lets DRF negotiate ?format= (or Accept) for export views, which stream the body themselves.
+    only error payloads ever go through render(), and those are sent as JSON.
+    """
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        response = (renderer_context or {}).get('response')
+        if response is not None:
+            response['Content-Type'] = 'application/json'
+        return JSONRenderer().render(data)
+
+
+class ExportNegotiation(DefaultContentNegotiation):
+    """
+    an unknown ?format= negotiates the last renderer (JSON) instead of DRF's 404, so the export
+    view runs and answers 400 with the formats it can write
+    """
+
+    def filter_renderers(self, renderers, format):
+        try:
+            return super().filter_renderers(renderers, format)
+        except Http404:
+            return renderers[-1:]
+
+
+EXPORT_RENDERERS = [
+    type(f'{encoder.name.title()}ExportRenderer', (ExportRenderer,), {
+        'format': encoder.name, 'media_type': encoder.content_type,
+    })
+    for encoder in ENCODERS.values()
+]
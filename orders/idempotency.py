@@ -0,0 +1,81 @@
+"""
+Idempotency-Key support for POST /api/orders/: a retry carrying the same key gets the stored
+response back and never reaches create_orders again, so stock is reserved once per key.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.response import Response
+import hashlib
+import json
+
+from .cache import LRUCache
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+# (company id, key) -> (request hash, status code, body), a hot retry costs no query at all
+recent_keys = LRUCache(settings.IDEMPOTENCY_CACHE_SIZE, settings.IDEMPOTENCY_CACHE_TTL)
+
+
+def request_hash(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, cls=DjangoJSONEncoder).encode()).hexdigest()
+
+
+def replay(company_id, key, digest):
+    """the stored response for a key seen before, None if the key is new (or expired)"""
+    entry = recent_keys.get((company_id, key))
+    if entry is None:
+        entry = IdempotencyKey.objects.filter(
+            company_id=company_id, key=key, expires_at__gt=timezone.now(), status_code__isnull=False
+        ).values_list('request_hash', 'status_code', 'response').first()
+        if entry is None:
+            return None
+        recent_keys.set((company_id, key), entry)
+
+    stored_hash, status_code, body = entry
+    if stored_hash != digest:
+        return Response({"error": f"{HEADER} was already used with a different request"}, status=422)
+    return Response(body, status=status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def _claim(company_id, key, digest):
+    now = timezone.now()
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(
+                    company_id=company_id, key=key, request_hash=digest,
+                    expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                )
+        except IntegrityError:
+            # taken; reuse it only if it has expired and purge_idempotency_keys hasn't run yet
+            if not IdempotencyKey.objects.filter(company_id=company_id, key=key, expires_at__lte=now).delete()[0]:
+                return None
+    return None
+
+
+def run_once(company_id, key, digest, handler):
+    """
+    ``handler()`` -> Response, called at most once per (company, key).
+
+    The key row is inserted before the handler runs and filled in after it, in the handler's
+    transaction: a concurrent retry blocks on the unique index until the first request commits
+    and then replays its response, and a handler that raises releases the key on rollback.
+    """
+    with transaction.atomic():
+        record = _claim(company_id, key, digest)
+        if record is not None:
+            response = handler()
+            record.status_code = response.status_code
+            record.response = response.data
+            record.save(update_fields=['status_code', 'response'])
+            entry = (digest, response.status_code, json.loads(json.dumps(response.data, cls=DjangoJSONEncoder)))
+            transaction.on_commit(lambda: recent_keys.set((company_id, key), entry))
+            return response
+
+    return replay(company_id, key, digest) or Response(
+        {"error": f"A request with this {HEADER} is still in progress"}, status=409
+    )
@@ -0,0 +1,162 @@
+"""
+Async order ingestion (served under ASGI): a batch is validated, stored as an IngestJob and
+answered with 202 right away; the DB work runs on a small bounded thread pool and the client
+polls /api/orders/jobs/<id>/ for the result. A few workers can keep thousands of slow clients
+in flight because no thread waits on a client.
+
+The job row is the source of truth, not the in-process task: a batch is claimed before it runs
+and marked done in the transaction that creates its orders, so a batch lost with its process
+(restart, crash) is either untouched or rolled back, and run_ingest_jobs runs it again.
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import APIException, NotAuthenticated, PermissionDenied
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+import asyncio
+import logging
+
+from .fast_serializers import fast_orders
+from .models import IngestJob
+from .permessions import IsAdminOrOperator
+from .serializers import OrderSerializer
+from .utils import OrderMixin
+
+logger = logging.getLogger('orders.ingest')
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_INGEST_WORKERS, thread_name_prefix='ingest')
+_in_flight = set() # keeps the job tasks referenced until they finish
+
+
+def in_pool(func):
+    """run ``func`` on the bounded ingest pool instead of the default per-request thread"""
+    def call(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False, executor=executor)
+
+
+def accept(request):
+    """authenticate, authorize and validate like OrderView.post does, then store the job"""
+    drf_request = Request(
+        request,
+        parsers=[JSONParser()],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    if not drf_request.user or not drf_request.user.is_authenticated:
+        raise NotAuthenticated()
+    if not IsAdminOrOperator().has_permission(drf_request, None):
+        raise PermissionDenied()
+
+    data = drf_request.data
+    if isinstance(data, dict):
+        data = [data]
+    serializer = OrderSerializer(data=data, many=True, context={'request': drf_request})
+    if not serializer.is_valid():
+        return None, serializer.errors
+
+    user = drf_request.user
+    job = IngestJob.objects.create(
+        company_id=user.company_id, created_by_id=user.pk,
+        lines=[{"product": line["product"].pk, "quantity": line["quantity"]} for line in serializer.validated_data],
+    )
+    return (job, user), None
+
+
+def _stale():
+    return timezone.now() - timedelta(seconds=settings.INGEST_JOB_TIMEOUT)
+
+
+def claim(job):
+    """mark the job running if it's queued (or its runner died), False when someone else has it"""
+    started_at = timezone.now()
+    claimed = IngestJob.objects.filter(
+        Q(status='queued') | Q(status='running', started_at__lt=_stale()), pk=job.pk,
+    ).update(status='running', started_at=started_at)
+    job.started_at = started_at
+    return bool(claimed)
+
+
+def run(job, user):
+    if not claim(job):
+        return
+    try:
+        with transaction.atomic():
+            created, failed = OrderMixin.create_orders(job.lines, user)
+            # done commits with the orders; if a late runner was superseded, roll its orders back
+            if not IngestJob.objects.filter(pk=job.pk, status='running', started_at=job.started_at).update(
+                status='done',
+                result={"created": fast_orders.data_from_instances(created), "failed_products": failed},
+                finished_at=timezone.now(),
+            ):
+                raise RuntimeError("job was reclaimed by another runner")
+    except Exception as exc:
+        logger.exception("ingest job %s failed", job.pk)
+        IngestJob.objects.filter(pk=job.pk, started_at=job.started_at).update(
+            status='failed', error=repr(exc), finished_at=timezone.now()
+        )
+
+
+def lost_jobs():
+    """jobs no process is working on: queued past the grace period, or running past the timeout"""
+    waiting = timezone.now() - timedelta(seconds=settings.INGEST_JOB_GRACE_SECONDS)
+    return (
+        IngestJob.objects.filter(Q(status='queued', created_at__lt=waiting) | Q(status='running', started_at__lt=_stale()))
+        .select_related('created_by').order_by('created_at')
+    )
+
+
+def recover(job):
+    """run a lost job in this process"""
+    if job.created_by is None:
+        IngestJob.objects.filter(pk=job.pk, status=job.status).update(
+            status='failed', error="the user who sent the batch no longer exists", finished_at=timezone.now()
+        )
+        return
+    run(job, job.created_by)
+
+
+@csrf_exempt # session callers are CSRF-checked by DRF's SessionAuthentication inside accept()
+async def order_ingest_view(request):
+    """
+    POST /api/orders/async/ — Queue one or more orders, same body as POST /api/orders/
+     response 202: {"job_id": "...", "status": "queued", "status_url": "/api/orders/jobs/<id>/"}
+     503 when too many batches are already in flight, retry later, or when not served under ASGI
+    """
+    if not isinstance(request, ASGIRequest):
+        # under WSGI the request's event loop closes with the response and takes the task with it
+        return JsonResponse({"detail": "Async ingestion needs the ASGI server (SERVER_MODE=asgi)"}, status=503)
+    if request.method != 'POST':
+        return JsonResponse({"detail": "Method not allowed"}, status=405)
+    if len(_in_flight) >= settings.ASYNC_INGEST_MAX_IN_FLIGHT:
+        return JsonResponse({"detail": "Too many batches in flight"}, status=503, headers={'Retry-After': '1'})
+
+    try:
+        accepted, errors = await in_pool(accept)(request)
+    except APIException as exc:
+        return JsonResponse({"detail": str(exc.detail)}, status=exc.status_code)
+    if errors:
+        return JsonResponse(errors, status=400, safe=False)
+
+    job, user = accepted
+    task = asyncio.create_task(in_pool(run)(job, user))
+    _in_flight.add(task)
+    task.add_done_callback(_in_flight.discard)
+
+    return JsonResponse({
+        "job_id": str(job.pk),
+        "status": job.status,
+        "status_url": reverse('ingest-job', args=[job.pk]),
+    }, status=202)
@@ -0,0 +1,181 @@
+"""
+Load testing the ordering API in-process: build a multi-tenant dataset, then replay a weighted
+mix of requests from concurrent clients and report latency percentiles, queries per request
+and throughput. Runs against whatever database the settings point to (SQLite or MySQL).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from decimal import Decimal
+import json
+import random
+import statistics
+import time
+
+from .analytics import rebuild_rollups
+from .models import Company, Order, Product, StockMovement, User
+
+DEFAULT_MIX = {'products': 40, 'post': 25, 'patch': 20, 'export': 5, 'orders': 10}
+
+
+def parse_mix(value):
+    """'products=40,post=25' -> {'products': 40, 'post': 25}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise ValueError(f"unknown request kind {name!r}, use one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = int(weight)
+    return mix
+
+
+def build_dataset(companies, products, orders, seed=0, prefix='loadtest'):
+    """
+    bulk create ``companies`` tenants with an operator each, ``products`` products and ``orders``
+    orders per tenant, with their sales rollups. returns the operators; an existing dataset with the
+    same prefix is reused.
+    """
+    rng = random.Random(seed)
+    existing = list(User.objects.filter(username__startswith=f'{prefix}_op_').order_by('id'))
+    if existing:
+        return existing
+    first_day = timezone.localdate()
+
+    Company.objects.bulk_create([Company(name=f'{prefix} company {i}') for i in range(companies)])
+    tenants = list(Company.objects.filter(name__startswith=f'{prefix} company ').order_by('id'))
+    password = make_password('loadtest')
+    User.objects.bulk_create([
+        User(username=f'{prefix}_op_{c.pk}', password=password, role='operator', company=c) for c in tenants
+    ])
+    operators = list(User.objects.filter(username__startswith=f'{prefix}_op_').order_by('id'))
+
+    Product.objects.bulk_create([
+        Product(
+            company_id=op.company_id, created_by=op, name=f'{prefix} c{op.company_id} product {i}',
+            price=Decimal(rng.randint(1000, 50000)) / 100, stock=rng.randint(10_000, 100_000),
+        )
+        for op in operators for i in range(products)
+    ], batch_size=2000)
+    catalog = defaultdict(list)
+    prices, openings = {}, []
+    for pk, company_id, stock, price in (
+        Product.objects.filter(company__in=tenants).values_list('id', 'company_id', 'stock', 'price')
+    ):
+        catalog[company_id].append(pk)
+        prices[pk] = price
+        openings.append(StockMovement(company_id=company_id, product_id=pk, delta=stock, reason='opening'))
+    StockMovement.objects.bulk_create(openings, batch_size=2000)
+
+    statuses = [s for s, _ in Order.STATUS_CHOICES]
+    for op in operators:
+        Order.objects.bulk_create([
+            Order(
+                company_id=op.company_id, created_by=op, product_id=product_id, unit_price=prices[product_id],
+                quantity=rng.randint(1, 5), status=rng.choice(statuses),
+            )
+            for product_id in (rng.choice(catalog[op.company_id]) for _ in range(orders))
+        ], batch_size=2000)
+    # bulk inserts skip the incremental rollup updates, /api/analytics/ would see no sales
+    rebuild_rollups(first_day, timezone.localdate())
+    return operators
+
+
+class Replayer:
+    """one simulated API client: a logged in operator with its own rng and test client"""
+
+    def __init__(self, operator, seed):
+        self.rng = random.Random(seed)
+        self.client = Client(raise_request_exception=False) # a crash is a 500 sample, not the end of the run
+        self.client.force_login(operator)
+        self.product_ids = list(
+            Product.active_objects.filter(company_id=operator.company_id).values_list('id', flat=True)
+        )
+        self.own_orders = []
+
+    def request(self, kind):
+        if kind == 'patch' and not self.own_orders:
+            kind = 'post' # operators can only edit today's orders, so make one first
+        if kind == 'products':
+            return kind, self.client.get('/api/products/')
+        if kind == 'orders':
+            return kind, self.client.get('/api/orders/?page_size=50')
+        if kind == 'export':
+            return kind, self.client.get('/api/orders/export/')
+        if kind == 'post':
+            lines = [
+                {'product': self.rng.choice(self.product_ids), 'quantity': self.rng.randint(1, 3)}
+                for _ in range(self.rng.randint(1, 20))
+            ]
+            response = self.client.post('/api/orders/', json.dumps(lines), content_type='application/json')
+            if response.status_code == 201:
+                self.own_orders += [o['id'] for o in response.json()['created']]
+            return kind, response
+        order_id = self.rng.choice(self.own_orders)
+        return kind, self.client.patch(
+            f'/api/orders/{order_id}/', json.dumps({'quantity': self.rng.randint(1, 3)}),
+            content_type='application/json'
+        )
+
+
+def _drain(response):
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+
+def replay(operators, requests, concurrency, mix=None, seed=0):
+    """
+    fire ``requests`` requests from ``concurrency`` clients, returns
+    (per kind list of (latency seconds, queries, status), wall clock seconds)
+    """
+    mix = mix or DEFAULT_MIX
+    kinds, weights = zip(*mix.items())
+    per_client = max(1, requests // concurrency)
+
+    # logging in writes sessions, do it up front rather than inside the measured threads
+    replayers = [Replayer(operators[i % len(operators)], seed + i) for i in range(concurrency)]
+
+    def client(replayer):
+        samples = []
+        try:
+            for kind in replayer.rng.choices(kinds, weights, k=per_client):
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    kind, response = replayer.request(kind)
+                    _drain(response)
+                    elapsed = time.perf_counter() - start
+                samples.append((kind, elapsed, len(ctx), response.status_code))
+        finally:
+            connection.close()
+        return samples
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, replayers))
+    wall = time.perf_counter() - start
+
+    by_kind = defaultdict(list)
+    for samples in results:
+        for kind, elapsed, queries, status in samples:
+            by_kind[kind].append((elapsed, queries, status))
+    return by_kind, wall
+
+
+def summarize(samples):
+    """p50/p95/p99 in ms, mean queries and error count for a list of (latency, queries, status)"""
+    latencies = sorted(s[0] * 1000 for s in samples)
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return {
+        'count': len(samples),
+        'errors': sum(1 for s in samples if s[2] >= 400),
+        'p50': p50, 'p95': p95, 'p99': p99,
+        'queries': statistics.mean(s[1] for s in samples),
+    }
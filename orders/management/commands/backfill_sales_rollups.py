@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+import time
+
+from orders.analytics import rebuild_rollups
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = "rebuild the daily sales rollups from the orders table (all days by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="first day to rebuild, YYYY-MM-DD (default: the first order)")
+        parser.add_argument('--until', help="last day to rebuild, YYYY-MM-DD (default: today)")
+
+    def handle(self, *args, **options):
+        first_day = self.day(options['since'], '--since')
+        last_day = self.day(options['until'], '--until') or timezone.localdate()
+        if first_day is None:
+            first = Order.objects.order_by('created_at').values_list('created_at', flat=True).first()
+            if first is None:
+                self.stdout.write("no orders, nothing to backfill")
+                return
+            first_day = timezone.localdate(first)
+
+        started = time.perf_counter()
+        written = rebuild_rollups(first_day, last_day)
+        self.stdout.write(self.style.SUCCESS(
+            f"rebuilt {written} rollup row(s) for {first_day} .. {last_day} in {time.perf_counter() - started:.2f}s"
+        ))
+
+    def day(self, value, option):
+        if value is None:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"{option} must be a date, YYYY-MM-DD")
+        return day
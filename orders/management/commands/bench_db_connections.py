@@ -0,0 +1,74 @@
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import RequestFactory
+import time
+
+from orders.authentication import issue_token
+from orders.loadtest import summarize
+from orders.models import User
+
+
+class Command(BaseCommand):
+    help = "per-request latency and connects with a new database connection per request vs persistent connections"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help="requests per mode")
+        parser.add_argument('--path', default='/api/orders/?page_size=20')
+        parser.add_argument('--user', default='operator1', help="username the requests authenticate as")
+        parser.add_argument('--max-age', type=int, default=600, help="CONN_MAX_AGE of the persistent modes")
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['user']).first()
+        if user is None:
+            raise CommandError(f"no user {options['user']!r}, run seed_data or pass --user")
+        path, _, query = options['path'].partition('?')
+        # the real WSGI handler, unlike the test client, sends request_started/finished to
+        # close_old_connections, which is where CONN_MAX_AGE and CONN_HEALTH_CHECKS act
+        environ = RequestFactory()._base_environ(
+            PATH_INFO=path, QUERY_STRING=query, REQUEST_METHOD='GET', HTTP_AUTHORIZATION=f'Bearer {issue_token(user)}',
+        )
+        handler = WSGIHandler()
+
+        self.stdout.write(f"{options['requests']} x GET {options['path']} on {connection.vendor}")
+        self.stdout.write(
+            f"{'mode':<22} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'connects':>9} {'errors':>6}"
+        )
+        for mode, max_age, health_checks in (
+            ('per request', 0, False),
+            ('persistent', options['max_age'], False),
+            ('persistent + checks', options['max_age'], True),
+        ):
+            samples = self.run(handler, environ, options['requests'], max_age, health_checks)
+            s = summarize(samples)
+            connects = sum(sample[1] for sample in samples)
+            self.stdout.write(
+                f"{mode:<22} {s['p50']:>8.2f} {s['p95']:>8.2f} {s['p99']:>8.2f} {connects:>9} {s['errors']:>6}"
+            )
+
+    def run(self, handler, environ, requests, max_age, health_checks):
+        """(latency, connections opened, status) per request"""
+        connection.close()
+        connection.settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+        opened = []
+
+        def created(sender, connection, **kwargs):
+            opened.append(connection)
+        connection_created.connect(created)
+
+        samples = []
+        try:
+            for _ in range(requests):
+                status = []
+                before = len(opened)
+                start = time.perf_counter()
+                response = handler(dict(environ), lambda code, headers: status.append(int(code[:3])))
+                for _ in response:
+                    pass
+                response.close() # request_finished
+                samples.append((time.perf_counter() - start, len(opened) - before, status[0]))
+        finally:
+            connection_created.disconnect(created)
+            connection.close()
+        return samples
@@ -0,0 +1,71 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+import gzip
+import random
+import time
+
+from orders.formats import ENCODERS, encode_chunks, get_encoder
+from orders.models import Order
+from orders.utils import EXPORT_CHUNK_SIZE, iter_order_chunks
+
+
+class Command(BaseCommand):
+    help = "encode time and size of every export format for the same orders (database time excluded)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200_000)
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--from-db', action='store_true', help="use the first --rows orders instead of generated ones")
+        parser.add_argument('--formats', default=','.join(ENCODERS))
+
+    def handle(self, *args, **options):
+        chunks = self.load(options['rows'], options['chunk_size'], options['from_db'])
+        rows = sum(len(chunk) for chunk in chunks)
+        self.stdout.write(f"{rows} orders in chunks of {options['chunk_size']}")
+        self.stdout.write(f"{'format':<8} {'encode ms':>10} {'rows/s':>10} {'MB':>8} {'gzip MB':>8} {'vs csv':>7}")
+
+        csv_size = None
+        for name in options['formats'].split(','):
+            try:
+                encoder = get_encoder(name)
+            except ValueError as exc:
+                self.stdout.write(f"{name:<8} skipped: {exc}")
+                continue
+            start = time.perf_counter()
+            blocks = list(encode_chunks(encoder, chunks))
+            elapsed = time.perf_counter() - start
+            size = sum(len(block) for block in blocks)
+            gzipped = sum(len(gzip.compress(block)) for block in blocks if block) # as export jobs write it
+            if name == 'csv':
+                csv_size = size
+            ratio = f"{size / csv_size:.2f}x" if csv_size else '-'
+            self.stdout.write(
+                f"{name:<8} {elapsed * 1000:>10.1f} {rows / elapsed:>10.0f} {size / 1e6:>8.2f} "
+                f"{gzipped / 1e6:>8.2f} {ratio:>7}"
+            )
+
+    def load(self, rows, chunk_size, from_db):
+        if from_db:
+            chunks, total = [], 0
+            for chunk in iter_order_chunks(Order.objects.all(), chunk_size):
+                chunks.append(chunk[:rows - total])
+                total += len(chunks[-1])
+                if total >= rows:
+                    break
+            if not chunks:
+                raise CommandError("no orders in the database, seed some or drop --from-db")
+            return chunks
+
+        rng = random.Random(0)
+        now = timezone.now()
+        statuses = ('pending', 'success', 'failed')
+        generated = []
+        for order_id in range(1, rows + 1):
+            created_at = now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600))
+            status = rng.choice(statuses)
+            generated.append((
+                order_id, f"Company {rng.randint(1, 50)} Product {rng.randint(1, 200)}", rng.randint(1, 10),
+                status, created_at + timedelta(hours=2) if status == 'success' else None, created_at,
+            ))
+        return [generated[i:i + chunk_size] for i in range(0, rows, chunk_size)]
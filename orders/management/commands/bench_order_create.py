@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+import time
+
+from orders.models import Company, Product, User
+from orders.utils import OrderMixin
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "compare statements/time of per-line vs bulk order creation for growing batch sizes (nothing is kept)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,100,500', help="comma separated batch sizes")
+        parser.add_argument('--products', type=int, default=20, help="distinct products the lines are spread over")
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        self.stdout.write(f"{'batch':>6} {'per-line q':>11} {'per-line ms':>12} {'bulk q':>7} {'bulk ms':>8}")
+        for size in sizes:
+            row = [size]
+            for path in ('per_line', 'bulk'):
+                queries, ms = self.measure(path, size, options['products'])
+                row += [queries, ms]
+            self.stdout.write(f"{row[0]:>6} {row[1]:>11} {row[2]:>12.1f} {row[3]:>7} {row[4]:>8.1f}")
+
+    def measure(self, path, size, product_count):
+        result = None
+        try:
+            with transaction.atomic():
+                company = Company.objects.create(name="bench company")
+                user = User.objects.create(username="bench_operator", role='operator', company=company)
+                products = Product.objects.bulk_create([
+                    Product(company=company, name=f"bench product {i}", price=1, stock=size * 10)
+                    for i in range(product_count)
+                ])
+                if products[0].pk is None:
+                    products = list(Product.objects.filter(company=company).order_by('id'))
+                lines = [{"product": products[i % product_count].id, "quantity": 1} for i in range(size)]
+
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    if path == 'bulk':
+                        OrderMixin.create_orders(lines, user)
+                    else:
+                        for line in lines:
+                            OrderMixin.create_order(line, user)
+                    elapsed = (time.perf_counter() - start) * 1000
+                # savepoints aren't round trips worth counting against either path
+                result = (sum(1 for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']), elapsed)
+                raise Rollback
+        except Rollback:
+            pass
+        return result
@@ -0,0 +1,69 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+import random
+import time
+
+from orders.fast_serializers import fast_orders, fast_products, render_json
+from orders.models import Order, Product
+from orders.serializers import OrderSerializer, ProductSerializer
+
+
+class Command(BaseCommand):
+    help = "ms per 10k rows of ModelSerializer + JSONRenderer vs the fast serializers (database time excluded)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=3, help="best of N runs")
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        products, orders = self.generate(rows)
+        per_10k = 10_000 / rows
+
+        self.stdout.write(f"{rows} rows, best of {repeat}, times per 10k rows")
+        self.stdout.write(f"{'serializer':<10} {'drf ms':>8} {'fast ms':>8} {'instances ms':>13} {'speedup':>8}")
+        for name, serializer_class, fast, instances in (
+            ('product', ProductSerializer, fast_products, products),
+            ('order', OrderSerializer, fast_orders, orders),
+        ):
+            tuples = [tuple(getattr(o, source) for source in fast.sources) for o in instances] # as values_list()
+            drf_body, drf = self.best(repeat, lambda: JSONRenderer().render(serializer_class(instances, many=True).data))
+            fast_body, fast_ms = self.best(repeat, lambda: fast.render(tuples))
+            from_instances, instances_ms = self.best(repeat, lambda: render_json(fast.data_from_instances(instances)))
+            if not drf_body == fast_body == from_instances:
+                raise CommandError(f"{name}: fast output differs from {serializer_class.__name__}")
+            self.stdout.write(
+                f"{name:<10} {drf * per_10k:>8.1f} {fast_ms * per_10k:>8.1f} {instances_ms * per_10k:>13.1f} "
+                f"{drf / fast_ms:>7.1f}x"
+            )
+        self.stdout.write(self.style.SUCCESS("output identical"))
+
+    def best(self, repeat, render):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            body = render()
+            timings.append((time.perf_counter() - start) * 1000)
+        return body, min(timings)
+
+    def generate(self, rows):
+        rng = random.Random(0)
+        now = timezone.now()
+        statuses = [s for s, _ in Order.STATUS_CHOICES]
+        products = [
+            Product(
+                id=i, company_id=1, created_by_id=rng.randint(1, 10), name=f"Company 1 Product {i} ünïcode",
+                price=Decimal(rng.randint(1000, 50000)) / 100, stock=rng.randint(0, 500), is_active=True,
+                created_at=now - timedelta(seconds=rng.randint(0, 90 * 24 * 3600)), last_updated_at=now,
+            )
+            for i in range(1, rows + 1)
+        ]
+        orders = [
+            Order(id=i, company_id=1, product_id=rng.randint(1, rows), quantity=rng.randint(1, 10),
+                  status=rng.choice(statuses))
+            for i in range(1, rows + 1)
+        ]
+        return products, orders
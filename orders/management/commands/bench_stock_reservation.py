@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from django.test.utils import override_settings
+import time
+
+from orders.models import Company, NotificationOutbox, Order, Product, User
+from orders.utils import OrderMixin
+
+
+class Command(BaseCommand):
+    help = "orders/sec of the locking vs conditional stock reservation with N threads ordering one product"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--orders', type=int, default=400, help="orders per strategy, split over the threads")
+        parser.add_argument('--strategies', default='locking,conditional')
+
+    def handle(self, *args, **options):
+        company = Company.objects.create(name=f"bench company {time.time_ns()}")
+        user = User.objects.create(username=f"bench_{company.pk}", role='operator', company=company)
+        product = Product.objects.create(
+            company=company, name=f"bench hot product {company.pk}", price=1, stock=options['orders'] * 10
+        )
+        try:
+            self.stdout.write(f"{'strategy':<12} {'threads':>7} {'ok':>6} {'errors':>6} {'orders/s':>9}")
+            for strategy in options['strategies'].split(','):
+                with override_settings(STOCK_RESERVATION=strategy):
+                    ok, errors, elapsed = self.hammer(product, user, options['threads'], options['orders'])
+                self.stdout.write(
+                    f"{strategy:<12} {options['threads']:>7} {ok:>6} {errors:>6} {ok / elapsed:>9.1f}"
+                )
+        finally:
+            orders = Order.objects.filter(company=company)
+            NotificationOutbox.objects.filter(payload__company=company.pk).delete()
+            orders.delete()
+            product.delete()
+            user.delete()
+            company.delete()
+
+    def hammer(self, product, user, threads, total):
+        per_thread = total // threads
+        line = {"product": product.pk, "quantity": 1}
+
+        def worker(_):
+            ok = errors = 0
+            try:
+                for _ in range(per_thread):
+                    try:
+                        if isinstance(OrderMixin.create_order(dict(line), user), Order):
+                            ok += 1
+                        else:
+                            errors += 1
+                    except DatabaseError: # lock wait timeouts / deadlocks count against the strategy
+                        errors += 1
+            finally:
+                connection.close()
+            return ok, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+        return sum(r[0] for r in results), sum(r[1] for r in results), elapsed
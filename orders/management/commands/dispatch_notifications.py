@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+import time
+
+from orders.notifications import dispatch_batch, get_sender, retry_failed
+
+
+class Command(BaseCommand):
+    help = "send queued order confirmations from the notification outbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=4, help="sender threads per batch")
+        parser.add_argument('--interval', type=float, default=2.0, help="seconds to sleep when the outbox is empty")
+        parser.add_argument('--once', action='store_true', help="drain the outbox and exit")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="requeue notifications that ran out of attempts before starting")
+
+    def handle(self, *args, **options):
+        sender = get_sender()
+        if options['retry_failed']:
+            self.stdout.write(f"requeued {retry_failed()} failed notification(s)")
+        while True:
+            count = dispatch_batch(sender, options['batch_size'], options['concurrency'])
+            if count:
+                self.stdout.write(f"dispatched {count} notification(s)")
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from orders.DTL import PAGE_SIZE
+from orders.fast_serializers import fast_products
+from orders.models import Company, Order, Product
+from orders.utils import EXPORT_CHUNK_SIZE, EXPORT_FIELDS
+
+
+def index_name(model, *fields):
+    """name Django gave the Meta.indexes entry on exactly these fields"""
+    for index in model._meta.indexes:
+        if tuple(index.fields) == fields:
+            return index.name
+    raise LookupError(f"{model.__name__} has no index on {fields}")
+
+
+def fk_index_name(model, field):
+    """name of the index Django gives a foreign key (MySQL's FK constraint index starts with it too)"""
+    with connection.schema_editor(collect_sql=True) as editor:
+        return editor._create_index_name(model._meta.db_table, [model._meta.get_field(field).column], suffix='')
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN the hot queries and check each one uses the index it was designed for"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help="tenant to plan the queries for, default the first one")
+
+    def handle(self, *args, **options):
+        company_id = options['company'] or Company.objects.order_by('id').values_list('id', flat=True).first()
+        product_id = Product.objects.filter(company_id=company_id).values_list('id', flat=True).first()
+        if company_id is None or product_id is None:
+            raise CommandError("no company with products, seed some data first")
+        now = timezone.now()
+        orders = Order.objects.filter(company_id=company_id)
+        active = Product.active_objects.filter(company_id=company_id)
+
+        checks = [
+            ("product catalog", fast_products.values(active), index_name(Product, 'company', 'is_active', 'name')),
+            ("dashboard page", active.order_by('name', 'id')[:PAGE_SIZE],
+             index_name(Product, 'company', 'is_active', 'name')),
+            ("order list", orders.order_by('-created_at', '-id')[:51],
+             index_name(Order, 'company', 'created_at', 'id')),
+            ("order list ?status=", orders.filter(status='pending').order_by('-created_at', '-id')[:51],
+             index_name(Order, 'company', 'status', 'created_at', 'id')),
+            ("order list ?product=", orders.filter(product_id=product_id).order_by('-created_at', '-id')[:51],
+             index_name(Order, 'product', 'created_at', 'id')),
+            ("order edit", orders.filter(id=1), 'PRIMARY'),
+            ("export job chunk", orders.filter(created_at__lt=now).order_by('created_at', 'id')[:2000],
+             index_name(Order, 'company', 'created_at', 'id')),
+            # iter_order_chunks' pk > last_pk keyset: the (company_id, id) FK index seeks straight to last_pk
+            ("export stream chunk", orders.order_by('pk').values_list(*EXPORT_FIELDS)
+             .filter(pk__gt=0)[:EXPORT_CHUNK_SIZE], fk_index_name(Order, 'company')),
+        ]
+
+        failed = 0
+        self.stdout.write(f"{'query':<22} {'expected index':<32} result")
+        for name, queryset, expected in checks:
+            plan = queryset.explain()
+            ok = expected in plan # MySQL's key column / SQLite's USING INDEX name, PRIMARY for pk lookups
+            failed += not ok
+            self.stdout.write(f"{name:<22} {expected:<32} {'ok' if ok else self.style.ERROR('MISSED')}")
+            if not ok or options['verbosity'] > 1:
+                self.stdout.write('    ' + plan.replace('\n', '\n    '))
+        if failed and connection.vendor != 'mysql':
+            # e.g. SQLite compiles is_active=True to a bare "WHERE is_active", which no index can seek on
+            self.stdout.write(self.style.WARNING(f"{failed} of {len(checks)} missed on {connection.vendor}, "
+                                                 f"the indexes are designed for MySQL's planner"))
+            return
+        if failed:
+            raise CommandError(f"{failed} of {len(checks)} queries don't use their index (small tables may "
+                               f"legitimately scan, run ANALYZE TABLE or check against production sized data)")
+        self.stdout.write(self.style.SUCCESS(f"all {len(checks)} queries use their index"))
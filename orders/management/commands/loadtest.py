@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.loadtest import DEFAULT_MIX, build_dataset, parse_mix, replay, summarize
+
+
+class Command(BaseCommand):
+    help = "build a multi-tenant dataset and replay mixed API traffic, reports latency percentiles, queries and throughput"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=10)
+        parser.add_argument('--products', type=int, default=200, help="products per company")
+        parser.add_argument('--orders', type=int, default=5000, help="orders per company")
+        parser.add_argument('--requests', type=int, default=1000, help="total requests to replay")
+        parser.add_argument('--concurrency', type=int, default=8, help="concurrent clients")
+        parser.add_argument(
+            '--mix', default=','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items()),
+            help="weighted request mix, kinds: " + ', '.join(DEFAULT_MIX)
+        )
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        self.stdout.write("preparing dataset...")
+        operators = build_dataset(options['companies'], options['products'], options['orders'], options['seed'])
+
+        self.stdout.write(f"replaying {options['requests']} requests with {options['concurrency']} clients...")
+        by_kind, wall = replay(operators, options['requests'], options['concurrency'], mix, options['seed'])
+
+        self.stdout.write(
+            f"{'request':<10} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8}"
+        )
+        total = 0
+        for kind, samples in sorted(by_kind.items()):
+            s = summarize(samples)
+            total += s['count']
+            self.stdout.write(
+                f"{kind:<10} {s['count']:>6} {s['errors']:>6} {s['p50']:>8.1f} {s['p95']:>8.1f} "
+                f"{s['p99']:>8.1f} {s['queries']:>8.1f}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{total} requests in {wall:.1f}s, {total / wall:.1f} req/s"))
@@ -0,0 +1,82 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+import time
+
+from orders.models import Product, ReconcileCheckpoint, StockBalance, StockMovement
+
+CHECKPOINT = 'stock'
+
+
+class Command(BaseCommand):
+    help = "compare Product.stock with the stock movement ledger, incrementally from the last checkpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="forget the checkpoint, re-sum the whole ledger and check every product")
+        parser.add_argument(
+            '--settle', type=int, default=60,
+            help="seconds a movement must be old before it is folded into the checkpoint (late commits)"
+        )
+        parser.add_argument('--fail-on-drift', action='store_true', help="exit non-zero when drift is found, for cron alerts")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        checkpoint, _ = ReconcileCheckpoint.objects.get_or_create(name=CHECKPOINT)
+        if options['full']:
+            StockBalance.objects.all().delete()
+            checkpoint.movement_id = 0
+
+        # fold settled movements into the balances: one grouped aggregate over the new ledger rows
+        settled = timezone.now() - timedelta(seconds=options['settle'])
+        watermark = (
+            StockMovement.objects.filter(id__gt=checkpoint.movement_id, created_at__lt=settled)
+            .order_by('-id').values_list('id', flat=True).first()
+        ) or checkpoint.movement_id
+        folded = self.deltas(checkpoint.movement_id, watermark)
+        with transaction.atomic():
+            balances = StockBalance.objects.select_for_update().in_bulk(list(folded))
+            for product_id, delta in folded.items():
+                balance = balances.setdefault(product_id, StockBalance(product_id=product_id))
+                balance.balance += delta
+            StockBalance.objects.bulk_create(
+                balances.values(), update_conflicts=True, update_fields=['balance'],
+                unique_fields=['product'] if connection.features.supports_update_conflicts_with_target else None,
+            )
+            checkpoint.movement_id = watermark
+            checkpoint.save()
+
+        # product rows and the movements past the watermark read together, both change in one transaction
+        with transaction.atomic():
+            recent = self.deltas(watermark)
+            products = Product.objects.values_list('id', 'stock')
+            if not options['full']:
+                products = products.filter(id__in=set(folded) | set(recent))
+            products = dict(products)
+            balances = dict(StockBalance.objects.filter(product_id__in=products).values_list('product_id', 'balance'))
+
+        drift = []
+        for product_id, stock in sorted(products.items()):
+            expected = balances.get(product_id, 0) + recent.get(product_id, 0)
+            if stock != expected:
+                drift.append((product_id, stock, expected))
+                self.stdout.write(self.style.WARNING(
+                    f"product {product_id}: stock {stock}, ledger says {expected} ({stock - expected:+d})"
+                ))
+
+        self.stdout.write(
+            f"checked {len(products)} product(s), folded {len(folded)} into checkpoint {watermark} "
+            f"in {time.perf_counter() - started:.2f}s, {len(drift)} drifting"
+        )
+        if drift and options['fail_on_drift']:
+            raise CommandError(f"{len(drift)} product(s) drift from the stock ledger")
+
+    def deltas(self, after, until=None):
+        """{product id: sum of deltas} of movements in (after, until]"""
+        movements = StockMovement.objects.filter(id__gt=after)
+        if until is not None:
+            movements = movements.filter(id__lte=until)
+        return dict(
+            movements.values('product_id').annotate(total=Sum('delta')).values_list('product_id', 'total').order_by()
+        )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+import time
+
+from orders.exports import claim_job, expire_exports, write_export
+
+EXPIRE_EVERY = 60 # seconds between deletions of files past EXPORT_RETENTION_SECONDS
+
+
+class Command(BaseCommand):
+    help = "write queued order exports to EXPORT_ROOT and delete the expired ones"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help="orders per query / written block")
+        parser.add_argument('--interval', type=float, default=2.0, help="seconds to sleep when no job is queued")
+        parser.add_argument('--once', action='store_true', help="run the queued jobs and exit")
+
+    def handle(self, *args, **options):
+        next_expiry = 0
+        while True:
+            if time.monotonic() >= next_expiry:
+                expired, failed = expire_exports()
+                if expired or failed:
+                    self.stdout.write(f"expired {expired} export(s), deleted {failed} failed one(s)")
+                next_expiry = time.monotonic() + EXPIRE_EVERY
+            job = claim_job()
+            if job is not None:
+                started = time.perf_counter()
+                write_export(job, options['chunk_size'])
+                job.refresh_from_db()
+                self.stdout.write(
+                    f"export {job.pk} {job.status}: {job.rows} rows, {job.size} bytes in {time.perf_counter() - started:.2f}s"
+                )
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+import time
+
+from orders.ingest import lost_jobs, recover
+
+
+class Command(BaseCommand):
+    help = "run async order batches whose web process lost them (restart, crash)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=10.0, help="seconds between scans")
+        parser.add_argument('--once', action='store_true', help="run the lost jobs and exit")
+
+    def handle(self, *args, **options):
+        while True:
+            for job in lost_jobs():
+                recover(job)
+                job.refresh_from_db()
+                self.stdout.write(f"ingest job {job.pk} recovered: {job.status}")
+            if options['once']:
+                return
+            time.sleep(options['interval'])
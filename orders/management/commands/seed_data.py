@@ -1,93 +1,164 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
 from django.utils import timezone
-from faker import Faker
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
 import random
+import time
 
-from orders.models import Company, Product, Order  
+from orders.analytics import rebuild_rollups
+from orders.models import Company, DailySalesRollup, Product, Order, StockMovement
+
+# roles of a company's users in order, repeated: 10 users are 4 viewers, 4 operators and 2 admins
+ROLE_CYCLE = ('viewer', 'operator', 'viewer', 'operator', 'admin')
+
+
+@contextmanager
+def keep_created_at(model):
+    """let bulk_create store the created_at set on the instances instead of auto_now_add's now()"""
+    field = model._meta.get_field('created_at')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
 
-fake = Faker()
 
 class Command(BaseCommand):
     help = "generate dummy data"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument('--companies', type=int, default=3)
+        parser.add_argument('--products', type=int, default=7, help="products per company")
+        parser.add_argument('--users', type=int, default=10, help="users per company")
+        parser.add_argument('--orders', type=int, default=40, help="orders in total")
+        parser.add_argument('--days', type=int, default=90, help="orders are spread over the last N days")
+        parser.add_argument('--batch-size', type=int, default=5000, help="rows per INSERT")
+        parser.add_argument('--seed', type=int, default=None, help="make the generated data reproducible")
+
+    def handle(self, *args, **options):
         User = get_user_model()
-        try:
-            self.stdout.write("creating ompanies...")
-            companies = []
-            for i in range(3): 
-                c = Company.objects.create(name=f"Company {i+1}")
-                companies.append(c)
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        company_names = [f"Company {i+1}" for i in range(options['companies'])]
+        if Company.objects.filter(name__in=company_names).exists():
+            self.stdout.write(self.style.SUCCESS("data generated before , no need to recreate it"))
+            return
+
+        with transaction.atomic():
+            self.stdout.write("creating companies...")
+            companies = self.bulk(Company, [Company(name=name) for name in company_names], batch_size)
 
 
             self.stdout.write("creating users...")
+            password = make_password("1") # hashed once, not once per user
+            numbers = dict.fromkeys(ROLE_CYCLE, 0)
+
+            def user(company, i):
+                role = ROLE_CYCLE[i % len(ROLE_CYCLE)]
+                numbers[role] += 1 # viewer1, viewer2, ... across all companies
+                return User(
+                    username=f"{role}{numbers[role]}",
+                    password=password,
+                    role=role,
+                    is_superuser=True , # to make all users superusers for simplicity testing
+                    is_staff=True,
+                    company=company
+                )
 
-            roles_distribution = (
-                ('viewer', 4),
-                ('operator', 4),
-                ('admin', 2),
-            )
-
-            users = []
-            for role, count in roles_distribution:
-                for i in range(count):
-                    u = User.objects.create_user(
-                        username=f"{role}{i+1}",
-                        password="1",
-                        role=role,
-                        is_superuser=True , # to make all users superusers for simplicity testing
-                        is_staff=True,
-                        company=random.choice(companies)
-                    )
-                    users.append(u)
+            users = self.bulk(User, [user(c, i) for c in companies for i in range(options['users'])], batch_size)
+            # products and orders are created by their own company's admins / operators
+            writers = {company.pk: [] for company in companies}
+            for u in users:
+                if u.role != 'viewer':
+                    writers[u.company_id].append(u)
+            for company in companies:
+                if not writers[company.pk]: # fewer than 2 users per company
+                    writers[company.pk] = [u for u in users if u.company_id == company.pk]
 
             self.stdout.write("creating products...")
-            products = []
-            for company in companies:
-                for i in range(7):  
-                    p = Product.objects.create(
-                        company=company,
-                        name=f"{company.name} Product {i+1}",
-                        price=random.uniform(10, 500),
-                        stock=random.randint(5, 200),
-                        created_by=random.choice(users),
-                        is_active=True
-                    )
-                    products.append(p)
+            products = self.bulk(Product, [
+                Product(
+                    company=company,
+                    name=f"{company.name} Product {i+1}",
+                    price=Decimal(rng.randint(1000, 50000)) / 100,
+                    stock=rng.randint(5, 200),
+                    created_by=rng.choice(writers[company.pk]) if writers[company.pk] else None,
+                    is_active=True
+                )
+                for company in companies for i in range(options['products'])
+            ], batch_size)
+            started = time.perf_counter() # no ids needed back, so not self.bulk
+            StockMovement.objects.bulk_create([
+                StockMovement(company_id=p.company_id, product=p, delta=p.stock, reason='opening') for p in products
+            ], batch_size=batch_size)
+            self.report(StockMovement, len(products), started)
 
 
             self.stdout.write("creating orders...")
 
             status_choices = ['pending', 'success', 'failed']
+            now = timezone.now()
+            span = options['days'] * 24 * 3600
 
-            all_orders = []
-            for i in range(40): 
-                product = random.choice(products)
-                company = product.company
-
-                quantity = random.randint(1, 10)
+            def order():
+                product = rng.choice(products)
+                quantity = rng.randint(1, 10)
 
                 if quantity > product.stock:
-                    status = random.choice(['pending', 'failed'])
+                    status = rng.choice(['pending', 'failed'])
                 else:
-                    status = random.choice(status_choices)
-
-                order = Order.objects.create(
-                    company=company,
+                    status = rng.choice(status_choices)
+
+                created_at = now - timedelta(seconds=rng.randint(0, span))
+                shipped_at = None
+                if status == 'success':
+                    shipped_at = min(created_at + timedelta(hours=rng.randint(1, 72)), now)
+                company_writers = writers[product.company_id]
+                return Order(
+                    company_id=product.company_id,
                     product=product,
                     quantity=quantity,
+                    unit_price=product.price,
                     status=status,
-                    created_by=random.choice(users)
+                    created_at=created_at,
+                    shipped_at=shipped_at,
+                    created_by=rng.choice(company_writers) if company_writers else None
                 )
 
-                if order.status == 'success':
-                    order.shipped_at = timezone.now()
-
-                order.save()
+            remaining = options['orders']
+            started, created = time.perf_counter(), 0
+            with keep_created_at(Order):
+                while remaining > 0: # build one batch at a time so millions of orders never sit in memory
+                    size = min(batch_size, remaining)
+                    Order.objects.bulk_create([order() for _ in range(size)])
+                    remaining -= size
+                    created += size
+            self.report(Order, created, started)
+
+            self.stdout.write("building sales rollups...") # bulk inserts skip the incremental rollup updates
+            started = time.perf_counter()
+            today = timezone.localdate(now)
+            first_day = timezone.localdate(now - timedelta(seconds=span))
+            self.report(DailySalesRollup, rebuild_rollups(first_day, today), started)
 
-                all_orders.append(order)
-        except :
-            self.stdout.write(self.style.SUCCESS("data generated before , no need to recreate it"))
-            return
         self.stdout.write(self.style.SUCCESS("data generated successfully"))
+
+    def bulk(self, model, objs, batch_size):
+        """bulk_create in batches, returns the saved rows (with pks) in creation order"""
+        started = time.perf_counter()
+        model.objects.bulk_create(objs, batch_size=batch_size)
+        if objs and objs[0].pk is None: # MySQL doesn't hand back ids from bulk inserts
+            key = 'username' if hasattr(objs[0], 'username') else 'name'
+            by_key = model.objects.in_bulk([getattr(o, key) for o in objs], field_name=key)
+            objs = [by_key[getattr(o, key)] for o in objs]
+        self.report(model, len(objs), started)
+        return objs
+
+    def report(self, model, count, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"  {count} {model.__name__} rows in {elapsed:.2f}s ({count / max(elapsed, 1e-6):.0f} rows/s)")
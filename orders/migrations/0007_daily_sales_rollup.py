@@ -0,0 +1,56 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def price_existing_orders(apps, schema_editor):
+    """existing orders get today's product price, the best there is"""
+    Order = apps.get_model('orders', 'Order')
+    Product = apps.get_model('orders', 'Product')
+    price = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1])
+    last_pk = 0
+    while True:
+        chunk = list(Order.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:5000])
+        if not chunk:
+            return
+        Order.objects.filter(pk__gte=chunk[0], pk__lte=chunk[-1]).update(unit_price=price)
+        last_pk = chunk[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10, null=True),
+        ),
+        migrations.RunPython(price_existing_orders, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(max_length=10)),
+                ('orders', models.IntegerField(default=0)),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='orders.company')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='orders.product')),
+            ],
+            options={
+                'unique_together': {('company', 'day', 'product', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:22
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed'), ('expired', 'expired')], default='queued', max_length=10)),
+                ('gzip', models.BooleanField(default=False)),
+                ('created_after', models.DateTimeField(blank=True, null=True)),
+                ('created_before', models.DateTimeField()),
+                ('filters', models.JSONField(blank=True, null=True)),
+                ('rows', models.PositiveIntegerField(default=0)),
+                ('size', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='orders.company')),
+                ('created_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='orders_expo_status_3b4c22_idx'), models.Index(fields=['company', 'created_at'], name='orders_expo_company_f199f5_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def open_balances(apps, schema_editor):
+    """one opening movement per existing product, so the ledger starts from today's stock"""
+    Product = apps.get_model('orders', 'Product')
+    StockMovement = apps.get_model('orders', 'StockMovement')
+    last_pk = 0
+    while True:
+        chunk = list(
+            Product.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'company_id', 'stock')[:2000]
+        )
+        if not chunk:
+            return
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=pk, company_id=company_id, delta=stock, reason='opening')
+            for pk, company_id, stock in chunk
+        ])
+        last_pk = chunk[-1][0]
+
+
+def drop_balances(apps, schema_editor):
+    apps.get_model('orders', 'StockMovement').objects.filter(reason='opening').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_stock_movement_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_balances, drop_balances),
+    ]
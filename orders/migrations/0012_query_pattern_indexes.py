@@ -0,0 +1,25 @@
+# Generated by Django 5.2.8 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_stock_opening_balances'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['company', 'status', 'created_at', 'id'], name='orders_orde_company_f1317b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['product', 'created_at', 'id'], name='orders_orde_product_3bddba_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['company', 'is_active', 'name'], name='orders_prod_company_ac9aeb_idx'),
+        ),
+    ]
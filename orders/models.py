@@ -1,8 +1,13 @@
-from django.db import models
+from collections import defaultdict
+from functools import reduce
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
-import logging
+import uuid
 
 class User(AbstractUser):
     ROLES = (
@@ -14,6 +19,19 @@ class User(AbstractUser):
     role = models.CharField(max_length=10, choices=ROLES, default='viewer')
     company = models.ForeignKey('Company', on_delete=models.PROTECT, null=True, blank=True, related_name='users')
 
+class ApiToken(models.Model):
+    """
+    a signed API token handed out by /api/auth/token/. the token itself carries the claims,
+    this row only exists so it can be revoked.
+    """
+    key = models.CharField(max_length=32, unique=True, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    created_at = models.DateTimeField(auto_now_add=True)
+    revoked_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user} token {self.key[:8]}"
+
 class AbstractCreationInfo(models.Model):
     created_by = models.ForeignKey(
         get_user_model(),
@@ -34,7 +52,13 @@ class Company(models.Model):
     def __str__(self):
         return self.name
 
-class ProductManager(models.Manager):
+class TenantQuerySet(models.QuerySet):
+
+    def for_tenant(self, tenant):
+        """rows of the tenant's company only (see orders.tenancy.get_tenant)"""
+        return self.filter(company_id=tenant.company_id)
+
+class ProductManager(models.Manager.from_queryset(TenantQuerySet)):
     def get_queryset(self):
         return super().get_queryset().filter(is_active=True)
 
@@ -47,48 +71,355 @@ class Product(AbstractCreationInfo):
     is_active = models.BooleanField(default=True)
 
 
-    objects = models.Manager() # includes soft-deleted items
+    objects = TenantQuerySet.as_manager() # includes soft-deleted items
     active_objects = ProductManager()
 
     class Meta:
         unique_together = ('company', 'name')
+        indexes = [
+            # active_objects.for_tenant(): the catalog, and the dashboard's pages ordered by name
+            models.Index(fields=['company', 'is_active', 'name']),
+        ]
 
     def __str__(self):
         return self.name
 
+class NotificationOutbox(models.Model):
+    """
+    confirmation "emails" waiting to be sent. rows are written in the same transaction as the
+    change they announce and sent after commit by the dispatch_notifications worker.
+    """
+    EVENTS = (
+        ('order_created', 'order_created'),
+        ('order_updated', 'order_updated'),
+        ('order_success', 'order_success'),
+    )
+    event = models.CharField(max_length=20, choices=EVENTS)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # not claimed again before this: pushed back while a worker sends it, and after each failure
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    failed_at = models.DateTimeField(null=True, blank=True) # gave up after notifications.MAX_ATTEMPTS
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dispatched_at', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.event} #{self.pk}"
+
+    @classmethod
+    def enqueue(cls, event, **payload):
+        return cls.objects.create(event=event, payload=payload)
+
+    @classmethod
+    def enqueue_many(cls, event, payloads):
+        return cls.objects.bulk_create([cls(event=event, payload=payload) for payload in payloads])
+
+class DailySalesRollup(models.Model):
+    """
+    orders, quantity and revenue per (company, product, day the order was created, status),
+    kept up to date by every order write (see record) and rebuilt by backfill_sales_rollups.
+    revenue is quantity x the order's unit_price, so taking an order back out removes exactly
+    what adding it put in, whatever the product costs today.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='sales_rollups')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sales_rollups')
+    day = models.DateField()
+    status = models.CharField(max_length=10)
+    orders = models.IntegerField(default=0)
+    quantity = models.BigIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('company', 'day', 'product', 'status')
+
+    def __str__(self):
+        return f"{self.day} {self.product_id} {self.status}"
+
+    @classmethod
+    def record(cls, changes):
+        """
+        apply (company_id, product_id, created_at, status, orders, quantity, revenue) deltas: one
+        INSERT that ignores existing rows, then one grouped UPDATE adding to every counter.
+        call it in the transaction of the order write so both commit or roll back together.
+        """
+        totals = defaultdict(lambda: [0, 0, 0])
+        for company_id, product_id, created_at, status, orders, quantity, revenue in changes:
+            total = totals[(company_id, timezone.localdate(created_at), product_id, status)]
+            total[0] += orders
+            total[1] += quantity
+            total[2] += revenue
+        totals = {key: total for key, total in sorted(totals.items()) if total != [0, 0, 0]}
+        if not totals:
+            return
+
+        cls.objects.bulk_create([
+            cls(company_id=company_id, day=day, product_id=product_id, status=status)
+            for company_id, day, product_id, status in totals
+        ], ignore_conflicts=True)
+
+        matches = {
+            key: Q(company_id=key[0], day=key[1], product_id=key[2], status=key[3]) for key in totals
+        }
+        def added(field, delta):
+            return Case(
+                *[When(matches[key], then=F(field) + delta(total)) for key, total in totals.items()],
+                default=F(field),
+                output_field=cls._meta.get_field(field),
+            )
+
+        cls.objects.filter(reduce(Q.__or__, matches.values())).update(
+            orders=added('orders', lambda total: total[0]),
+            quantity=added('quantity', lambda total: total[1]),
+            revenue=added('revenue', lambda total: total[2]),
+        )
+
+def order_success_payload(order_id, company_id, created_by_id, product_id, quantity, shipped_at):
+    return {
+        'order_id': order_id, 'company': company_id, 'user': created_by_id,
+        'product': product_id, 'qty': quantity, 'shipped_at': shipped_at,
+    }
+
+class OrderQuerySet(TenantQuerySet):
+
+    def transition(self, status):
+        """
+        Move every order in the queryset to ``status`` with a single UPDATE.
+        Orders moving to success get shipped_at (if unset) and their confirmation queued,
+        just like Order.save does one by one. returns the number of orders that changed.
+        """
+        with transaction.atomic(using=self.db):
+            moved = list(
+                self.exclude(status=status).select_for_update().order_by('pk')
+                .values_list('pk', 'company_id', 'created_by_id', 'product_id', 'quantity', 'shipped_at',
+                             'status', 'created_at', 'unit_price')
+            )
+            if not moved:
+                return 0
+
+            now = timezone.now()
+            changes = {'status': status}
+            if status == 'success':
+                changes['shipped_at'] = Coalesce('shipped_at', Value(now))
+            Order.objects.filter(pk__in=[row[0] for row in moved]).update(**changes)
+
+            DailySalesRollup.record(
+                change
+                for _, company_id, _, product_id, quantity, _, old_status, created_at, unit_price in moved
+                for change in (
+                    (company_id, product_id, created_at, old_status, -1, -quantity, -quantity * unit_price),
+                    (company_id, product_id, created_at, status, 1, quantity, quantity * unit_price),
+                )
+            )
+
+            if status == 'success':
+                NotificationOutbox.enqueue_many('order_success', [
+                    order_success_payload(pk, company_id, created_by_id, product_id, quantity, shipped_at or now)
+                    for pk, company_id, created_by_id, product_id, quantity, shipped_at, _, _, _ in moved
+                ])
+        return len(moved)
+
 class Order(AbstractCreationInfo):
     STATUS_CHOICES = (('pending','pending'),('success','success'),('failed','failed'))
     company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='orders')
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='orders')
     quantity = models.PositiveIntegerField()
+    # the product's price when the order was placed (or moved to another product), for revenue
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, editable=False)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     shipped_at = models.DateTimeField(null=True, blank=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         indexes = [
-            models.Index(fields=['company', 'created_at']),
+            # the cursor pages order by (created_at, id), id spelled out for backends that don't append the pk
+            models.Index(fields=['company', 'created_at', 'id']),
             models.Index(fields=['status', 'created_at']),
+            # GET /api/orders/?status=, newest first within the tenant
+            models.Index(fields=['company', 'status', 'created_at', 'id']),
+            # GET /api/orders/?product=, and finding the ids of just inserted orders on MySQL
+            models.Index(fields=['product', 'created_at', 'id']),
         ]
 
     def __str__(self):
         return f"Order {self.id} - {self.product.name} ({self.quantity})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the row as loaded, so save() knows about transitions without re-reading it
+        instance._loaded = instance._rollup_key()
+        return instance
+
+    def _rollup_key(self):
+        return tuple(
+            self.__dict__.get(field) for field in ('status', 'product_id', 'quantity', 'created_at', 'unit_price')
+        )
+
+    def _rollup_change(self, status, product_id, quantity, unit_price, sign):
+        return (self.company_id, product_id, self.created_at, status, sign, sign * quantity, sign * quantity * unit_price)
+
     def save(self, *args, **kwargs):
         is_new = self._state.adding  #does instance new
         prev_status = None
 
         if not is_new:
-            prev_status = Order.objects.values_list('status', flat=True).get(pk=self.pk)
+            loaded = getattr(self, '_loaded', None)
+            if loaded is None or None in loaded: # fields were deferred (or the instance came from bulk_create)
+                loaded = Order.objects.values_list(
+                    'status', 'product_id', 'quantity', 'created_at', 'unit_price'
+                ).get(pk=self.pk)
+            prev_status = loaded[0]
 
-        super().save(*args, **kwargs)
+        if is_new and self.unit_price is None or not is_new and self.product_id != loaded[1] and self.unit_price == loaded[4]:
+            self.unit_price = Product.objects.values_list('price', flat=True).get(pk=self.product_id)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'unit_price' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'unit_price']
 
-        if self.status == 'success' and (is_new or prev_status != 'success'):
-            if not self.shipped_at:
-                self.shipped_at = timezone.now()
-                super().save(update_fields=['shipped_at'])
+        became_success = self.status == 'success' and (is_new or prev_status != 'success')
 
-            logger = logging.getLogger('orders.confirmation')
-            logger.info(
-                "Order %s for company %s by %s marked SUCCESS. product=%s qty=%s shipped_at=%s",
-                self.pk, self.company_id, self.created_by_id, self.product_id, self.quantity, self.shipped_at
-            )
+        if became_success and not self.shipped_at:
+            self.shipped_at = timezone.now()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'shipped_at' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'shipped_at']
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if became_success:
+                NotificationOutbox.enqueue('order_success', **order_success_payload(
+                    self.pk, self.company_id, self.created_by_id, self.product_id, self.quantity, self.shipped_at
+                ))
+            current = self._rollup_key()
+            new = self._rollup_change(self.status, self.product_id, self.quantity, self.unit_price, 1)
+            if is_new:
+                DailySalesRollup.record([new])
+            elif current[:3] + current[4:] != tuple(loaded[:3]) + tuple(loaded[4:]):
+                status, product_id, quantity, _, unit_price = loaded
+                DailySalesRollup.record([self._rollup_change(status, product_id, quantity, unit_price, -1), new])
+        self._loaded = current
+
+class IngestJob(models.Model):
+    """an order batch accepted by the async ingestion endpoint, polled by the client until done"""
+    STATUS_CHOICES = (('queued','queued'),('running','running'),('done','done'),('failed','failed'))
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='ingest_jobs')
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='ingest_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    lines = models.JSONField()
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"ingest job {self.pk} ({self.status})"
+
+class IdempotencyKey(models.Model):
+    """
+    the response of a POST /api/orders/ sent with an Idempotency-Key, replayed to retries
+    of the same request until expires_at (purged by purge_idempotency_keys)
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(encoder=DjangoJSONEncoder, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ('company', 'key')
+
+    def __str__(self):
+        return f"{self.company_id}:{self.key}"
+
+class ExportJob(models.Model):
+    """
+    an order export written to disk by the run_export_jobs worker: the company's orders created
+    in [created_after, created_before), narrowed by the admin changelist's filters when queued
+    from there. a done job's file is deleted after EXPORT_RETENTION_SECONDS and the job expires
+    """
+    STATUS_CHOICES = (
+        ('queued','queued'),('running','running'),('done','done'),('failed','failed'),('expired','expired')
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='export_jobs')
+    created_by = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='export_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    format = models.CharField(max_length=10, default='csv') # a name from orders.formats.ENCODERS
+    gzip = models.BooleanField(default=False)
+    created_after = models.DateTimeField(null=True, blank=True)
+    created_before = models.DateTimeField()
+    filters = models.JSONField(null=True, blank=True) # Order lookups from orders.exports.EXPORT_FILTERS
+    rows = models.PositiveIntegerField(default=0)
+    size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['company', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"export {self.pk} ({self.status})"
+
+    @property
+    def filename(self):
+        return f"orders-{self.pk}.{self.format}" + (".gz" if self.gzip else "")
+
+class StockMovement(models.Model):
+    """
+    append-only ledger of every change to Product.stock, written in the transaction of the
+    change itself. a product's stock is the sum of its deltas, starting with an opening row.
+    """
+    REASONS = (
+        ('opening', 'opening'),
+        ('order_created', 'order_created'),
+        ('order_updated', 'order_updated'),
+        ('import', 'import'),
+        ('adjustment', 'adjustment'),
+    )
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='stock_movements')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL, related_name='stock_movements')
+    delta = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.product_id} {self.delta:+d} ({self.reason})"
+
+    @classmethod
+    def record(cls, reason, **movement):
+        return cls.objects.create(reason=reason, **movement)
+
+    @classmethod
+    def record_many(cls, reason, movements):
+        return cls.objects.bulk_create([cls(reason=reason, **movement) for movement in movements if movement['delta']])
+
+class StockBalance(models.Model):
+    """a product's ledger total up to the reconcile_stock checkpoint"""
+    product = models.OneToOneField(Product, primary_key=True, on_delete=models.CASCADE, related_name='+')
+    balance = models.BigIntegerField(default=0)
+
+class ReconcileCheckpoint(models.Model):
+    """the last StockMovement id folded into StockBalance"""
+    name = models.CharField(max_length=50, unique=True)
+    movement_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.movement_id}"
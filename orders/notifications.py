@@ -0,0 +1,123 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+import logging
+import sys
+
+from .models import NotificationOutbox
+
+MESSAGES = {
+    'order_created': "Order created: order_id=%(order_id)s user=%(user)s company=%(company)s product=%(product)s qty=%(qty)s",
+    'order_updated': "Order %(order_id)s for company %(company)s had update by %(user)s. product=%(product)s qty=%(qty)s",
+    'order_success': "Order %(order_id)s for company %(company)s by %(user)s marked SUCCESS. product=%(product)s qty=%(qty)s shipped_at=%(shipped_at)s",
+}
+
+MAX_ATTEMPTS = 5
+
+logger = logging.getLogger(__name__)
+
+
+def render(notification):
+    return MESSAGES[notification.event] % notification.payload
+
+
+class LogSender:
+    """writes every confirmation to the orders.confirmation logger (order_confirmations.log)"""
+    def __init__(self):
+        self.logger = logging.getLogger('orders.confirmation')
+
+    def send(self, notification):
+        self.logger.info(render(notification))
+
+
+class ConsoleSender:
+    """prints confirmations to stdout, handy in development and tests"""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, notification):
+        self.stream.write(render(notification) + "\n")
+
+
+def get_sender():
+    return import_string(settings.NOTIFICATION_SENDER)()
+
+
+def retry_delay(attempts):
+    """seconds before the next try of a notification that failed ``attempts`` times"""
+    return settings.NOTIFICATION_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim_batch(batch_size):
+    """
+    pending notifications that are due, pushed back by NOTIFICATION_CLAIM_TIMEOUT and with the
+    attempt counted before the row locks are released, so no other worker claims them while they
+    are being sent (and a worker that dies mid-batch only delays them)
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True)
+            .filter(dispatched_at__isnull=True, failed_at__isnull=True, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        NotificationOutbox.objects.filter(pk__in=[n.pk for n in batch]).update(
+            attempts=F('attempts') + 1, next_attempt_at=now + timedelta(seconds=settings.NOTIFICATION_CLAIM_TIMEOUT)
+        )
+    for notification in batch:
+        notification.attempts += 1
+    return batch
+
+
+def dispatch_batch(sender, batch_size=500, concurrency=4):
+    """
+    Send one batch of due notifications, returns how many were picked up.
+
+    Rows are claimed with SKIP LOCKED in a short transaction of their own (see claim_batch) so
+    several workers can drain the outbox side by side and no lock is held while sending. They go
+    through a small thread pool, then are marked sent in one UPDATE and failed in one UPDATE per
+    distinct error and attempt count. A failed row waits retry_delay() before its next attempt;
+    one that fails for the MAX_ATTEMPTS-th time gets failed_at and is logged.
+    """
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0
+
+    def send(notification):
+        try:
+            sender.send(notification)
+        except Exception as exc:
+            return notification, repr(exc)
+        return notification, None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, batch))
+
+    now = timezone.now()
+    sent = [n.pk for n, error in results if error is None]
+    if sent:
+        NotificationOutbox.objects.filter(pk__in=sent).update(dispatched_at=now)
+    failed = defaultdict(list)
+    for notification, error in results:
+        if error is not None:
+            failed[error, notification.attempts].append(notification)
+    for (error, attempts), notifications in failed.items():
+        changes = {'last_error': error, 'next_attempt_at': now + timedelta(seconds=retry_delay(attempts))}
+        if attempts >= MAX_ATTEMPTS:
+            changes['failed_at'] = now
+            for notification in notifications:
+                logger.error("giving up on %s after %d attempts: %s", notification, attempts, error)
+        NotificationOutbox.objects.filter(pk__in=[n.pk for n in notifications]).update(**changes)
+    return len(batch)
+
+
+def retry_failed():
+    """put notifications that ran out of attempts back in the queue, returns how many"""
+    return NotificationOutbox.objects.filter(failed_at__isnull=False, dispatched_at__isnull=True).update(
+        failed_at=None, attempts=0, next_attempt_at=timezone.now()
+    )
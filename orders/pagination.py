@@ -0,0 +1,44 @@
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+import datetime
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    """
+    keyset pagination on created_at (newest first), every page is an index range
+    scan that starts where the previous one ended, no OFFSET however deep you go.
+    id breaks created_at ties (bulk inserts share a timestamp), so the rows the
+    cursor skips within a tie are always the same ones.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+def _parse_moment(name, value, end_of_day=False):
+    try: # well formed but impossible values (2025-02-30, month 13) raise instead of returning None
+        moment = parse_datetime(value)
+        day = parse_date(value) if moment is None else None
+    except ValueError:
+        moment = day = None
+    if moment is None:
+        if day is None:
+            raise ValidationError({name: "Use an ISO date or datetime"})
+        moment = datetime.datetime.combine(day, datetime.time.max if end_of_day else datetime.time.min)
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def filter_created_range(queryset, params):
+    """?created_after= / ?created_before= (inclusive, dates or datetimes)"""
+    if params.get('created_after'):
+        queryset = queryset.filter(created_at__gte=_parse_moment('created_after', params['created_after']))
+    if params.get('created_before'):
+        queryset = queryset.filter(
+            created_at__lte=_parse_moment('created_before', params['created_before'], end_of_day=True)
+        )
+    return queryset
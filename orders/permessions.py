@@ -1,21 +1,27 @@
 from rest_framework.permissions import BasePermission
 from .models import User
+from .tenancy import get_tenant
+
+ADMIN, OPERATOR = User.ROLES[0][0], User.ROLES[1][0]
+
+def _has_role(request, *roles):
+    tenant = get_tenant(request)
+    return tenant is not None and tenant.role in roles
 
 class IsAdmin(BasePermission):
     """
     Custom permission to only allow admin users to access certain views.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and request.user.role == User.ROLES[0][0]
+        return _has_role(request, ADMIN)
 class IsOperator(BasePermission):
     """
     Custom permission to only allow operator users to access certain views.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.is_authenticated and request.user.role == User.ROLES[1][0]
+        return _has_role(request, OPERATOR)
 
 class IsAdminOrOperator(BasePermission):
     """ both (OR logic) """
     def has_permission(self, request, view):
-        return IsAdmin().has_permission(request, view) or \
-               IsOperator().has_permission(request, view)
+        return _has_role(request, ADMIN, OPERATOR)
@@ -0,0 +1,172 @@
+"""
+Bulk product import: rows are validated column by column (no serializer per row), then
+upserted on (company, name) with bulk_create(update_conflicts=True) one batch at a time.
+"""
+from decimal import Decimal, InvalidOperation
+from django.db import connection, transaction
+import unicodedata
+
+from .cache import invalidate_catalog
+from .models import Product, StockMovement
+
+MAX_STOCK = 2147483647
+UPDATE_FIELDS = ['price', 'stock', 'is_active', 'last_updated_at']
+TRUE, FALSE = {'1', 'true', 'yes', 'y'}, {'0', 'false', 'no', 'n'}
+
+
+def _name(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("This field is required.")
+    value = value.strip()
+    if len(value) > Product._meta.get_field('name').max_length:
+        raise ValueError("Ensure this field has no more than 255 characters.")
+    return value
+
+
+def name_key(name):
+    """
+    what MySQL's utf8mb4_0900_ai_ci collation compares: case and accents ignored. names that
+    share a key are the same row to the unique index, so every name map is keyed by this
+    """
+    decomposed = unicodedata.normalize('NFKD', name)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        raise ValueError("A valid number is required.")
+    if not price.is_finite() or price < 0:
+        raise ValueError("Ensure this value is a positive number.")
+    # 8 integer digits at most; checked before quantize(), which raises on huge exponents (1e30)
+    if price and price.adjusted() > 7:
+        raise ValueError("Ensure there are no more than 10 digits and 2 decimal places.")
+    if price != price.quantize(Decimal('0.01')):
+        raise ValueError("Ensure there are no more than 10 digits and 2 decimal places.")
+    return price.quantize(Decimal('0.01'))
+
+
+def _stock(value):
+    try:
+        stock = int(str(value).strip())
+    except ValueError:
+        raise ValueError("A valid integer is required.")
+    if not 0 <= stock <= MAX_STOCK:
+        raise ValueError(f"Ensure this value is between 0 and {MAX_STOCK}.")
+    return stock
+
+
+def _is_active(value):
+    if value in (None, ''):
+        return True
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in TRUE:
+        return True
+    if text in FALSE:
+        return False
+    raise ValueError("Must be a valid boolean.")
+
+
+COLUMNS = {'name': _name, 'price': _price, 'stock': _stock, 'is_active': _is_active}
+REQUIRED = ('name', 'price', 'stock')
+
+
+def validate_rows(rows):
+    """
+    returns (clean rows as {index: {field: value}}, errors as {index: {field: [message]}}),
+    indexes are 0-based positions in ``rows``,
+    one pass per column and one for names repeated inside the file
+    """
+    errors = {}
+    clean = {index: {} for index, row in enumerate(rows) if isinstance(row, dict)}
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[index] = {'non_field_errors': ["Expected an object."]}
+
+    for field, parse in COLUMNS.items():
+        for index, values in clean.items():
+            raw = rows[index].get(field)
+            if raw in (None, '') and field in REQUIRED:
+                errors.setdefault(index, {})[field] = ["This field is required."]
+                continue
+            try:
+                values[field] = parse(raw)
+            except ValueError as exc:
+                errors.setdefault(index, {})[field] = [str(exc)]
+
+    first_seen = {}
+    for index, values in clean.items():
+        if values.get('name') is None:
+            continue
+        key = name_key(values['name'])
+        if key in first_seen:
+            errors.setdefault(index, {})['name'] = [f"Duplicate of row {first_seen[key] + 1}."]
+        else:
+            first_seen[key] = index
+
+    return {index: values for index, values in clean.items() if index not in errors}, errors
+
+
+def import_products(rows, company_id, user, batch_size=1000):
+    """
+    upsert valid rows into the company's products, returns {"created", "updated", "errors"}.
+    product names are unique across companies, so a name another company already uses is a
+    row error rather than an overwrite of someone else's product.
+    """
+    clean, errors = validate_rows(rows)
+    indexes = sorted(clean)
+    created = updated = 0
+    # MySQL upserts on whichever unique key collides and can't be given a conflict target
+    unique_fields = ['company', 'name'] if connection.features.supports_update_conflicts_with_target else None
+
+    for start in range(0, len(indexes), batch_size):
+        batch = indexes[start:start + batch_size]
+        with transaction.atomic():
+            # the locking read also holds off anyone inserting these names until commit
+            owners, stock = {}, {}
+            for name, owner, current in (
+                Product.objects.select_for_update()
+                .filter(name__in=[clean[i]['name'] for i in batch]).values_list('name', 'company_id', 'stock')
+            ):
+                owners[name_key(name)], stock[name_key(name)] = owner, current
+            accepted = []
+            for index in batch:
+                owner = owners.get(name_key(clean[index]['name']))
+                if owner is not None and owner != company_id:
+                    errors[index] = {'name': ["A product with this name already exists."]}
+                else:
+                    accepted.append(index)
+            if not accepted:
+                continue
+
+            Product.objects.bulk_create([
+                Product(company_id=company_id, created_by=user, **clean[index])
+                for index in accepted
+            ], update_conflicts=True, unique_fields=unique_fields, update_fields=UPDATE_FIELDS)
+            existing = sum(1 for index in accepted if name_key(clean[index]['name']) in owners)
+            created += len(accepted) - existing
+            updated += existing
+            invalidate_catalog(company_id)
+
+            # MySQL doesn't return ids from an upsert, so read them back (the names are locked).
+            # an update keeps the stored spelling of the name, hence the keys
+            ids = {
+                name_key(name): pk for name, pk in
+                Product.objects.filter(company_id=company_id, name__in=[clean[i]['name'] for i in accepted])
+                .values_list('name', 'id')
+            }
+            for reason, opening in (('opening', True), ('import', False)):
+                StockMovement.record_many(reason, [
+                    {'company_id': company_id, 'product_id': ids[key], 'delta': values['stock'] - stock.get(key, 0)}
+                    for key, values in ((name_key(clean[index]['name']), clean[index]) for index in accepted)
+                    if (key not in stock) == opening
+                ])
+
+    return {
+        'created': created,
+        'updated': updated,
+        'errors': [{'row': index + 1, 'errors': errors[index]} for index in sorted(errors)],
+    }
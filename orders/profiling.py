@@ -0,0 +1,198 @@
+"""
+Per-request profiling: query count, DB time, serializer time and total latency for every view,
+sent back as a Server-Timing header and aggregated into Prometheus histograms at /api/metrics/.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+import logging
+import threading
+import time
+
+logger = logging.getLogger('orders.profiling')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+_current = ContextVar('orders_request_profile', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(limit):
+    """declare how many queries a view may run, works on view classes and function views"""
+    def decorate(view):
+        view.query_budget = limit
+        return view
+    return decorate
+
+
+def allow_queries(count):
+    """raise the current request's budget by ``count`` for statements that scale with its input"""
+    profile = _current.get()
+    if profile is not None:
+        profile.allowance += count
+
+
+class RequestProfile:
+    def __init__(self):
+        self.queries = 0
+        self.allowance = 0
+        self.db_time = 0.0
+        self.sections = defaultdict(float)
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+@contextmanager
+def timed(section):
+    """add the time spent in the block to ``section`` of the current request profile, if any"""
+    profile = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.sections[section] += time.perf_counter() - start
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """in-process registry, one set of series per view"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.db_seconds = defaultdict(float)
+        self.serializer_seconds = defaultdict(float)
+
+    def observe(self, view, total, profile):
+        with self.lock:
+            self.latency[view].observe(total)
+            self.queries[view].observe(profile.queries)
+            self.db_seconds[view] += profile.db_time
+            self.serializer_seconds[view] += profile.sections.get('serializer', 0.0)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, help_text, series in (
+                ('orders_request_duration_seconds', 'Total view latency', self.latency),
+                ('orders_request_queries', 'SQL statements per request', self.queries),
+            ):
+                lines += [f'# HELP {name} {help_text}.', f'# TYPE {name} histogram']
+                for view, hist in sorted(series.items()):
+                    cumulative = 0
+                    for bound, count in zip((*hist.buckets, '+Inf'), hist.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {hist.sum}')
+                    lines.append(f'{name}_count{{view="{view}"}} {hist.count}')
+            for name, help_text, series in (
+                ('orders_request_db_seconds_total', 'Time spent in the database', self.db_seconds),
+                ('orders_request_serializer_seconds_total', 'Time spent in serializers', self.serializer_seconds),
+            ):
+                lines += [f'# HELP {name} {help_text}.', f'# TYPE {name} counter']
+                lines += [f'{name}{{view="{view}"}} {value}' for view, value in sorted(series.items())]
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _view_name(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+def _budget(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    func = match.func
+    view_class = getattr(func, 'view_class', None) or getattr(func, 'cls', None)
+    budget = getattr(func, 'query_budget', None)
+    if budget is None:
+        budget = getattr(view_class, 'query_budget', None)
+    return budget
+
+
+class ProfilingMiddleware:
+    """
+    Queries of a StreamingHttpResponse body run after the view returns and are not counted.
+    With QUERY_BUDGET_ENFORCE a view that runs more queries than its declared
+    query_budget raises QueryBudgetExceeded, which fails the test that made the request.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - start
+
+        view = _view_name(request)
+        metrics.observe(view, total, profile)
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={profile.db_time * 1000:.1f};desc="{profile.queries} queries"',
+            *(f'{name};dur={seconds * 1000:.1f}' for name, seconds in profile.sections.items()),
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+        budget = _budget(request)
+        if budget is not None:
+            budget += profile.allowance
+        if budget is not None and profile.queries > budget:
+            message = f"{view} ran {profile.queries} queries, its budget is {budget}"
+            if settings.QUERY_BUDGET_ENFORCE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+def metrics_view(request):
+    """GET /api/metrics/ — Prometheus text exposition of the per-view histograms, staff or METRICS_TOKEN only"""
+    token = settings.METRICS_TOKEN
+    scraper = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not scraper and not (request.user.is_authenticated and request.user.is_staff):
+        return HttpResponse("Staff session or metrics token required", status=403, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4')
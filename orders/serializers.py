@@ -1,17 +1,18 @@
 
 from rest_framework import serializers
 from .models import Product, Order
+from .tenancy import get_tenant
 
 class ProductDeleteSerializer(serializers.Serializer):
     ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, write_only=True)
 
     def validate_ids(self, ids):
-        user = self.context['request'].user
+        tenant = get_tenant(self.context['request'])
         
-        products = Product.active_objects.filter(id__in=ids, company=user.company)
+        found = set(Product.active_objects.for_tenant(tenant).filter(id__in=ids).values_list('id', flat=True))
         
-        if products.count() != len(ids):
-            missing_ids = set(ids) - set(products.values_list('id', flat=True))
+        missing_ids = set(ids) - found
+        if missing_ids:
             raise serializers.ValidationError(
                 {"missing_ids": list(missing_ids)}
             )
@@ -25,20 +26,57 @@ class ProductSerializer(serializers.ModelSerializer):
         fields = ['id','name','price','stock','is_active','created_by','created_at','last_updated_at']
         read_only_fields = ['id','created_by','created_at','last_updated_at','is_active']
 
+class OrderListSerializer(serializers.ListSerializer):
+    """
+    validates a list of order lines with a single product query: every referenced product is
+    loaded up front and each line's product field resolves from that map
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for item in data:
+                pk = item.get('product') if isinstance(item, dict) else None
+                if isinstance(pk, int) and not isinstance(pk, bool) or isinstance(pk, str) and pk.isdigit():
+                    ids.add(int(pk))
+            self.products = Product.objects.in_bulk(ids) if ids else {}
+        return super().to_internal_value(data)
+
+
+class BatchProductField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField that looks in OrderListSerializer.products before querying"""
+
+    def to_internal_value(self, data):
+        products = getattr(self.root, 'products', None)
+        if products is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            product = products.get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if product is None:
+            self.fail('does_not_exist', pk_value=data)
+        return product
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    product = BatchProductField(queryset=Product.objects.all())
 
     class Meta:
         model = Order
         fields = ["id", "product", "quantity", "status"]
+        list_serializer_class = OrderListSerializer
 
     def validate_product(self, product):
-        user = self.context["request"].user
+        tenant = get_tenant(self.context["request"])
 
-        if product.company != user.company:
-            raise serializers.ValidationError("Product does not belong to your company")
         if not product:
             raise serializers.ValidationError("Invalid product")
-        return product.id
+        if product.company_id != tenant.company_id:
+            raise serializers.ValidationError("Product does not belong to your company")
+        return product # the loaded instance, create_orders / update_order use it as is
 
     def validate_quantity(self, qty):
         if qty <= 0:
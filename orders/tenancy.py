@@ -0,0 +1,35 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Tenant:
+    """who is calling, resolved once per request: their company and role"""
+    user_id: int
+    company_id: int
+    role: str
+
+
+def get_tenant(request):
+    """
+    Tenant of an authenticated request, or None. It's read from the already authenticated
+    user (plain columns, no Company lookup) and memoized on the underlying HttpRequest, so
+    permissions, views and serializers of one request share the same object.
+    works with both DRF and plain Django requests.
+    """
+    http_request = getattr(request, '_request', request)
+    tenant = getattr(http_request, '_tenant', None)
+    if tenant is None:
+        user = request.user
+        if not (user and user.is_authenticated):
+            return None
+        tenant = Tenant(user_id=user.pk, company_id=user.company_id, role=user.role)
+        http_request._tenant = tenant
+    return tenant
+
+
+class TenantViewMixin:
+    """gives DRF views ``self.tenant``"""
+
+    @property
+    def tenant(self):
+        return get_tenant(self.request)
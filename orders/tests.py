@@ -1,3 +1,820 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from io import StringIO
+from unittest import mock, skipUnless
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+from .models import (
+    Company, DailySalesRollup, ExportJob, IngestJob, NotificationOutbox, Order, Product, StockMovement, User,
+)
+from . import exports, idempotency, ingest
+from .authentication import SignedTokenAuthentication, issue_token, verified_tokens
+from .analytics import rebuild_rollups
+from .DTL import dashboard_stats
+from .notifications import MAX_ATTEMPTS, claim_batch, dispatch_batch, retry_failed
+from .utils import OrderMixin
+from .product_import import import_products, name_key, validate_rows
+
+
+class TenantTestCase(TestCase):
+    """two companies with an operator each and a couple of products for the first one"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(name="Company A")
+        cls.other_company = Company.objects.create(name="Company B")
+        cls.operator = User.objects.create(username="operator_a", role='operator', company=cls.company)
+        cls.admin = User.objects.create(username="admin_a", role='admin', company=cls.company)
+        cls.other_operator = User.objects.create(username="operator_b", role='operator', company=cls.other_company)
+        cls.product = Product.objects.create(
+            company=cls.company, name="Widget", price=Decimal('10.00'), stock=100, created_by=cls.admin
+        )
+        cls.other_product = Product.objects.create(
+            company=cls.company, name="Gadget", price=Decimal('5.50'), stock=50, created_by=cls.admin
+        )
+        StockMovement.objects.bulk_create([
+            StockMovement(company=cls.company, product=p, delta=p.stock, reason='opening')
+            for p in (cls.product, cls.other_product)
+        ])
+
+    def setUp(self):
+        # company ids come back after each test's rollback, the process-wide caches must not
+        caches['default'].clear()
+        idempotency.recent_keys.clear()
+        verified_tokens.clear()
+        self.client.force_login(self.operator)
+
+
+class ProductImportNameTests(TenantTestCase):
+
+    def test_name_key_ignores_case_and_accents(self):
+        self.assertEqual(name_key("Wídget"), name_key("WIDGET"))
+        self.assertNotEqual(name_key("Widget"), name_key("Widgets"))
+
+    def test_mixed_case_duplicates_in_one_file(self):
+        clean, errors = validate_rows([
+            {'name': "Lamp", 'price': '1', 'stock': 1},
+            {'name': "lamp", 'price': '1', 'stock': 1},
+            {'name': "LÄMP", 'price': '1', 'stock': 1},
+        ])
+        self.assertEqual(list(clean), [0])
+        self.assertEqual(errors[1], {'name': ["Duplicate of row 1."]})
+        self.assertEqual(errors[2], {'name': ["Duplicate of row 1."]})
+
+    def test_same_case_upsert(self):
+        report = import_products([{'name': "Widget", 'price': '12.00', 'stock': 80}], self.company.pk, self.admin)
+        self.assertEqual((report['created'], report['updated'], report['errors']), (0, 1, []))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.stock), (Decimal('12.00'), 80))
+        self.assertEqual(StockMovement.objects.filter(product=self.product, reason='import').get().delta, -20)
+
+    def test_out_of_range_prices_are_row_errors(self):
+        self.client.force_login(self.admin)
+        body = "name,price,stock\nHuge,1e30,1\nHuger,1E+1000000,1\nFine,12.50,3\n"
+        response = self.client.post('/api/products/import/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual(report['created'], 1)
+        self.assertEqual([(e['row'], list(e['errors'])) for e in report['errors']], [(1, ['price']), (2, ['price'])])
+
+    @skipUnless(connection.vendor == 'mysql', "needs MySQL's case insensitive name collation")
+    def test_mixed_case_name_updates_own_product(self):
+        report = import_products([{'name': "widget", 'price': '12.00', 'stock': 90}], self.company.pk, self.admin)
+        self.assertEqual((report['created'], report['updated'], report['errors']), (0, 1, []))
+        self.assertEqual(StockMovement.objects.filter(product=self.product, reason='import').get().delta, -10)
+
+    @skipUnless(connection.vendor == 'mysql', "needs MySQL's case insensitive name collation")
+    def test_mixed_case_name_of_another_company_is_rejected(self):
+        report = import_products(
+            [{'name': "wídget", 'price': '1.00', 'stock': 1}], self.other_company.pk, self.other_operator
+        )
+        self.assertEqual(report['errors'], [{'row': 1, 'errors': {'name': ["A product with this name already exists."]}}])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.company_id, self.product.stock), (self.company.pk, 100))
+
+
+class TenantAdminTests(TenantTestCase):
+
+    def test_staff_only_see_their_company(self):
+        self.admin.is_staff = True
+        self.admin.save()
+        self.admin.user_permissions.set(Permission.objects.filter(content_type__app_label='orders'))
+        Product.objects.create(company=self.other_company, name="Other tenant thing", price=1, stock=1)
+        self.client.force_login(self.admin)
+
+        response = self.client.get('/admin/orders/order/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "Company B")
+        response = self.client.get('/admin/orders/product/')
+        self.assertNotContains(response, "Company B")
+        self.assertNotContains(response, "Other tenant thing")
+        self.assertContains(response, "Widget")
+
+
+class TokenAuthenticationTests(TenantTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.token = self.client.post('/api/auth/token/').json()['token']
+        self.client.logout()
+
+    def get(self, token=None):
+        return self.client.get('/api/orders/', headers={'Authorization': f'Bearer {token or self.token}'})
+
+    def authenticate(self):
+        request = RequestFactory().get('/', headers={'Authorization': f'Bearer {self.token}'})
+        return SignedTokenAuthentication().authenticate(request)
+
+    def test_issued_token_authenticates(self):
+        self.assertEqual(self.get().status_code, 200)
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+
+    def test_cached_hit_costs_no_query(self):
+        with self.assertNumQueries(1):
+            user, claims = self.authenticate()
+        with self.assertNumQueries(0):
+            cached, _ = self.authenticate()
+        self.assertEqual((cached.pk, cached.company_id, cached.role), (self.operator.pk, self.company.pk, 'operator'))
+
+    def test_revoke_evicts_the_cached_token(self):
+        self.assertEqual(self.get().status_code, 200)
+        response = self.client.delete('/api/auth/token/', headers={'Authorization': f'Bearer {self.token}'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(issue_token(self.operator)).status_code, 200)
+
+    def test_expired_and_tampered_tokens(self):
+        with override_settings(API_TOKEN_MAX_AGE=-1):
+            response = self.get()
+        self.assertEqual((response.status_code, response.json()['detail']), (401, "Token expired"))
+        tampered = self.token[:-1] + ('A' if self.token[-1] != 'A' else 'B')
+        self.assertEqual(self.get(tampered).json()['detail'], "Invalid token")
+        response = self.client.get('/api/orders/', headers={'Authorization': 'Bearer \xff\xfe'})
+        self.assertEqual((response.status_code, response.json()['detail']), (401, "Invalid token header"))
+
+    def test_role_or_company_change_invalidates(self):
+        self.assertEqual(self.get().status_code, 200)
+        User.objects.filter(pk=self.operator.pk).update(role='viewer')
+        # this process trusts its cache until API_TOKEN_CACHE_TTL, a cache miss checks the user again
+        with mock.patch('orders.cache.time.monotonic', return_value=time.monotonic() + 3600):
+            self.assertEqual(self.get().status_code, 401)
+
+        User.objects.filter(pk=self.operator.pk).update(role='operator', company=self.other_company)
+        verified_tokens.clear()
+        self.assertEqual(self.get().status_code, 401)
+        User.objects.filter(pk=self.operator.pk).update(company=self.company)
+        self.assertEqual(self.get().status_code, 200)
+
+    def test_admin_lists_own_company_tokens(self):
+        issue_token(self.other_operator)
+        self.admin.is_staff = True
+        self.admin.save()
+        self.admin.user_permissions.set(Permission.objects.filter(content_type__app_label='orders'))
+        self.client.force_login(self.admin)
+        response = self.client.get('/admin/orders/apitoken/')
+        self.assertContains(response, "operator_a token")
+        self.assertNotContains(response, "operator_b")
+
+
+class CursorFilterTests(TenantTestCase):
+
+    def make_orders(self):
+        now = timezone.now()
+        Order.objects.bulk_create([
+            Order(company=self.company, product=self.product, quantity=1, unit_price=self.product.price, status=status,
+                  created_by=self.operator)
+            for status in ('pending', 'success', 'pending')
+        ])
+        for days, order in enumerate(Order.objects.filter(company=self.company).order_by('id')):
+            Order.objects.filter(pk=order.pk).update(created_at=now - timedelta(days=days * 10))
+        Order.objects.create(company=self.other_company, product=self.product, quantity=1, created_by=self.other_operator)
+
+    def test_filters_and_pages(self):
+        self.make_orders()
+        response = self.client.get('/api/orders/?status=pending&page_size=1')
+        self.assertEqual(response.status_code, 200)
+        first = response.json()
+        self.assertEqual(len(first['results']), 1)
+        second = self.client.get(first['next']).json()
+        self.assertEqual(second['next'], None)
+        self.assertEqual({o['status'] for o in first['results'] + second['results']}, {'pending'})
+
+        since = (timezone.now() - timedelta(days=15)).date().isoformat()
+        results = self.client.get(f'/api/orders/?created_after={since}').json()['results']
+        self.assertEqual(len(results), 2) # the other tenant's order is never listed
+
+    def test_created_at_ties_page_by_id(self):
+        Order.objects.bulk_create([
+            Order(company=self.company, product=self.product, quantity=1, unit_price=self.product.price,
+                  created_by=self.operator)
+            for _ in range(5)
+        ])
+        Order.objects.update(created_at=timezone.now())
+        ids, url = [], '/api/orders/?page_size=2'
+        while url:
+            page = self.client.get(url).json()
+            ids += [o['id'] for o in page['results']]
+            url = page['next']
+        self.assertEqual(ids, sorted(Order.objects.values_list('id', flat=True), reverse=True))
+
+    def test_invalid_dates_are_400(self):
+        for url in (
+            '/api/orders/?created_after=2025-02-30',
+            '/api/orders/?created_after=2025-13-01T00:00',
+            '/api/orders/?created_before=yesterday',
+            '/api/products/?created_before=2030-02-31',
+        ):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400, url)
+
+
+class DashboardStatsTests(TenantTestCase):
+
+    def test_one_query_for_every_card(self):
+        Product.objects.create(company=self.company, name="Gone", price=Decimal('99.00'), stock=1,
+                               created_by=self.admin, is_active=False)
+        Product.objects.create(company=self.company, name="Low", price=Decimal('1.00'), stock=2, created_by=self.admin)
+        Product.objects.create(company=self.other_company, name="Theirs", price=Decimal('1.00'), stock=1)
+        for status in ('pending', 'pending', 'failed'):
+            Order.objects.create(company=self.company, product=self.product, quantity=1, created_by=self.operator,
+                                 status=status)
+        with self.assertNumQueries(1):
+            stats = dashboard_stats(self.company.id)
+        self.assertEqual(stats['product_count'], 3)
+        self.assertEqual(stats['total_stock'], 152)
+        self.assertEqual(stats['price_avg'].quantize(Decimal('0.01')), Decimal('5.50'))
+        self.assertEqual(stats['low_stock_count'], 1)
+        self.assertEqual(stats['orders_today'], {'pending': 2, 'success': 0, 'failed': 1})
+
+    def test_company_without_products(self):
+        stats = dashboard_stats(self.other_company.id)
+        self.assertEqual((stats['product_count'], stats['total_stock'], stats['price_avg']), (0, 0, None))
+        self.assertEqual(stats['orders_today'], {'pending': 0, 'success': 0, 'failed': 0})
+
+
+@override_settings(QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(TenantTestCase):
+    """every request below fails with QueryBudgetExceeded if its view runs over budget"""
+
+    def post(self, lines, **headers):
+        return self.client.post('/api/orders/', json.dumps(lines), content_type='application/json', headers=headers)
+
+    def exercise(self):
+        ids = [self.product.pk, self.other_product.pk]
+        self.assertEqual(self.post({'product': ids[0], 'quantity': 1}).status_code, 201)
+        many = self.post([{'product': pk, 'quantity': 1} for pk in ids] * 10)
+        self.assertEqual(many.status_code, 201)
+        self.assertEqual(self.post([{'product': pk, 'quantity': 10_000} for pk in ids] * 10).status_code, 201)
+        self.assertEqual(self.post([{'product': ids[0], 'quantity': 1}], **{'Idempotency-Key': 'k'}).status_code, 201)
+        order_id = many.json()['created'][0]['id']
+        response = self.client.patch(
+            f'/api/orders/{order_id}/', json.dumps({'quantity': 2, 'product': ids[1]}), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        for url in ('/api/orders/', '/api/orders/?status=pending', '/api/products/', '/api/products/?page_size=5',
+                    '/api/analytics/'):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+    def test_locking_reservation(self):
+        with override_settings(STOCK_RESERVATION='locking'):
+            self.exercise()
+
+    def test_conditional_reservation(self):
+        with override_settings(STOCK_RESERVATION='conditional'):
+            self.exercise()
+
+
+class MetricsAccessTests(TenantTestCase):
+
+    def test_tenants_are_refused(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_staff_and_token(self):
+        self.admin.is_staff = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+        self.client.logout()
+        with override_settings(METRICS_TOKEN='s3cret'):
+            self.assertEqual(self.client.get('/api/metrics/', headers={'Authorization': 'Bearer s3cret'}).status_code, 200)
+            self.assertEqual(self.client.get('/api/metrics/', headers={'Authorization': 'Bearer nope'}).status_code, 403)
+
+
+class OrderTransitionTests(TenantTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.orders, _ = OrderMixin.create_orders(
+            [{'product': self.product, 'quantity': 1}, {'product': self.product, 'quantity': 2},
+             {'product': self.other_product, 'quantity': 3}, {'product': self.other_product, 'quantity': 4}],
+            self.operator,
+        )
+        self.shipped_before = timezone.now() - timedelta(days=3)
+        pending, failed_shipped, failed, done = self.orders
+        Order.objects.filter(pk=failed_shipped.pk).update(status='failed', shipped_at=self.shipped_before)
+        Order.objects.filter(pk=failed.pk).update(status='failed')
+        Order.objects.filter(pk=done.pk).update(status='success', shipped_at=self.shipped_before)
+        DailySalesRollup.objects.all().delete()
+        NotificationOutbox.objects.all().delete()
+
+    def test_moves_the_whole_queryset_with_one_update(self):
+        with CaptureQueriesContext(connection) as queries:
+            moved = Order.objects.filter(company=self.company).transition('success')
+        self.assertEqual(moved, 3)
+        update = f"UPDATE {connection.ops.quote_name(Order._meta.db_table)} "
+        updates = [q['sql'] for q in queries if q['sql'].startswith(update)]
+        self.assertEqual(len(updates), 1, updates)
+        self.assertEqual(set(Order.objects.values_list('status', flat=True)), {'success'})
+
+    def test_shipped_at_is_only_set_where_null(self):
+        Order.objects.filter(company=self.company).transition('success')
+        shipped = dict(Order.objects.values_list('pk', 'shipped_at'))
+        pending, failed_shipped, failed, done = (o.pk for o in self.orders)
+        self.assertEqual((shipped[failed_shipped], shipped[done]), (self.shipped_before, self.shipped_before))
+        self.assertGreater(shipped[pending], self.shipped_before)
+        self.assertEqual(shipped[pending], shipped[failed])
+
+    def test_orders_already_there_are_skipped(self):
+        self.assertEqual(Order.objects.filter(status='success').transition('success'), 0)
+        self.assertEqual(Order.objects.filter(status='failed').transition('failed'), 0)
+        self.assertFalse(DailySalesRollup.objects.exists())
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_notifications_and_rollups_only_for_moved_orders(self):
+        pending, failed_shipped, failed, done = self.orders
+        Order.objects.filter(company=self.company).transition('success')
+        payloads = {n.payload['order_id']: n.payload for n in NotificationOutbox.objects.filter(event='order_success')}
+        self.assertEqual(set(payloads), {pending.pk, failed_shipped.pk, failed.pk})
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+        deltas = {
+            (r.product_id, r.status): (r.orders, r.quantity, r.revenue) for r in DailySalesRollup.objects.all()
+        }
+        self.assertEqual(deltas, {
+            (self.product.pk, 'pending'): (-1, -1, Decimal('-10.00')),
+            (self.product.pk, 'failed'): (-1, -2, Decimal('-20.00')),
+            (self.product.pk, 'success'): (2, 3, Decimal('30.00')),
+            (self.other_product.pk, 'failed'): (-1, -3, Decimal('-16.50')),
+            (self.other_product.pk, 'success'): (1, 3, Decimal('16.50')),
+        })
+
+
+class RollupTests(TenantTestCase):
+
+    def rollups(self):
+        return {
+            (r.product_id, r.status): (r.orders, r.quantity, r.revenue)
+            for r in DailySalesRollup.objects.filter(company=self.company).exclude(orders=0, quantity=0, revenue=0)
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollups()
+        today = timezone.localdate()
+        rebuild_rollups(today, today)
+        self.assertEqual(incremental, self.rollups())
+
+    def test_create_transition_and_edit(self):
+        created, failed = OrderMixin.create_orders(
+            [{'product': self.product, 'quantity': 2}, {'product': self.other_product.pk, 'quantity': 3}], self.operator
+        )
+        self.assertEqual(failed, [])
+        self.assertEqual(self.rollups(), {
+            (self.product.pk, 'pending'): (1, 2, Decimal('20.00')),
+            (self.other_product.pk, 'pending'): (1, 3, Decimal('16.50')),
+        })
+        Order.objects.filter(pk=created[0].pk).transition('success')
+        OrderMixin.update_order(created[1], {'quantity': 1}, self.operator)
+        self.assertEqual(self.rollups(), {
+            (self.product.pk, 'success'): (1, 2, Decimal('20.00')),
+            (self.other_product.pk, 'pending'): (1, 1, Decimal('5.50')),
+        })
+        self.assertMatchesRebuild()
+
+    def test_price_change_between_create_and_reversal(self):
+        order, _ = OrderMixin.create_orders([{'product': self.product, 'quantity': 2}], self.operator)
+        Product.objects.filter(pk=self.product.pk).update(price=Decimal('20.00'))
+        Order.objects.filter(pk=order[0].pk).transition('failed')
+        self.assertEqual(self.rollups(), {(self.product.pk, 'failed'): (1, 2, Decimal('20.00'))})
+
+        OrderMixin.update_order(Order.objects.get(pk=order[0].pk), {'quantity': 1, 'product': self.other_product},
+                                self.operator)
+        self.assertEqual(self.rollups(), {(self.other_product.pk, 'failed'): (1, 1, Decimal('5.50'))})
+        self.assertMatchesRebuild()
+
+    def test_edit_from_a_stale_instance(self):
+        created, _ = OrderMixin.create_orders([{'product': self.product, 'quantity': 2}], self.operator)
+        stale = Order.objects.get(pk=created[0].pk)
+        OrderMixin.update_order(Order.objects.get(pk=created[0].pk), {'quantity': 5}, self.operator)
+        OrderMixin.update_order(stale, {'quantity': 3}, self.operator) # a concurrent PATCH that loaded first
+        self.assertEqual(self.rollups(), {(self.product.pk, 'pending'): (1, 3, Decimal('30.00'))})
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 97)
+
+
+class FlakySender:
+    """fails every notification whose order_id is odd, with an error naming it"""
+
+    def send(self, notification):
+        if notification.payload['order_id'] % 2:
+            raise ConnectionError(f"order {notification.payload['order_id']} bounced")
+
+
+class NotificationDispatchTests(TestCase):
+
+    def setUp(self):
+        for order_id in range(1, 5):
+            NotificationOutbox.enqueue('order_created', order_id=order_id, user='u', company='c', product='p', qty=1)
+
+    def test_each_failure_keeps_its_own_error(self):
+        self.assertEqual(dispatch_batch(FlakySender()), 4)
+        rows = {n.payload['order_id']: n for n in NotificationOutbox.objects.all()}
+        self.assertIsNotNone(rows[2].dispatched_at)
+        self.assertEqual(rows[1].last_error, "ConnectionError('order 1 bounced')")
+        self.assertEqual(rows[3].last_error, "ConnectionError('order 3 bounced')")
+        self.assertEqual((rows[1].attempts, rows[1].failed_at), (1, None))
+
+    def make_due(self):
+        NotificationOutbox.objects.update(next_attempt_at=timezone.now())
+
+    def test_failures_back_off(self):
+        started = timezone.now()
+        self.assertEqual(dispatch_batch(FlakySender()), 4)
+        self.assertEqual(dispatch_batch(FlakySender()), 0) # a sender outage doesn't burn the attempts
+        self.make_due()
+        self.assertEqual(dispatch_batch(FlakySender()), 2)
+        delays = {
+            n.attempts: n.next_attempt_at - started for n in NotificationOutbox.objects.filter(dispatched_at__isnull=True)
+        }
+        self.assertEqual(list(delays), [2])
+        self.assertGreaterEqual(delays[2], timedelta(seconds=60))
+
+    def test_claimed_rows_are_hidden_while_sending(self):
+        claimed = claim_batch(10)
+        self.assertEqual([n.attempts for n in claimed], [1, 1, 1, 1])
+        self.assertEqual(claim_batch(10), []) # no lock held, the rows are pushed back instead
+        self.assertEqual(NotificationOutbox.objects.filter(attempts=1).count(), 4)
+
+    def test_gives_up_visibly_and_can_be_retried(self):
+        with self.assertLogs('orders.notifications', 'ERROR') as logs:
+            for _ in range(MAX_ATTEMPTS):
+                self.make_due()
+                dispatch_batch(FlakySender())
+        self.make_due()
+        self.assertEqual(dispatch_batch(FlakySender()), 0)
+        failed = NotificationOutbox.objects.filter(failed_at__isnull=False)
+        self.assertEqual(sorted(n.payload['order_id'] for n in failed), [1, 3])
+        self.assertEqual(len(logs.records), 2)
+
+        self.assertEqual(retry_failed(), 2)
+        self.assertEqual(dispatch_batch(FlakySender()), 2)
+
+
+class BatchCreateTests(TenantTestCase):
+
+    def post(self, lines, **headers):
+        return self.client.post('/api/orders/', json.dumps(lines), content_type='application/json', headers=headers)
+
+    def create(self, strategy):
+        with override_settings(STOCK_RESERVATION=strategy):
+            response = self.post([
+                {'product': self.product.pk, 'quantity': 60},
+                {'product': self.other_product.pk, 'quantity': 5},
+                {'product': self.product.pk, 'quantity': 50}, # 60 + 50 > 100 in stock
+                {'product': self.product.pk, 'quantity': 40},
+            ])
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body['failed_products'], [self.product.pk])
+        self.assertEqual([(o['product'], o['quantity']) for o in body['created']],
+                         [(self.product.pk, 60), (self.other_product.pk, 5), (self.product.pk, 40)])
+        orders = Order.objects.in_bulk([o['id'] for o in body['created']])
+        self.assertEqual(sorted(o.quantity for o in orders.values()), [5, 40, 60])
+        self.assertEqual(
+            dict(StockMovement.objects.filter(reason='order_created').values_list('order_id', 'delta')),
+            {pk: -o.quantity for pk, o in orders.items()},
+        )
+        self.assertEqual(NotificationOutbox.objects.count(), 3)
+        self.assertEqual(dict(Product.objects.values_list('name', 'stock')), {"Widget": 0, "Gadget": 45})
+
+    def test_locking_reservation(self):
+        self.create('locking')
+
+    def test_conditional_reservation(self):
+        self.create('conditional')
+
+    def test_ids_read_back_when_the_insert_returns_none(self):
+        bulk_create = Order.objects.bulk_create
+
+        def without_ids(orders, *args, **kwargs): # what MySQL does with a multi-row INSERT
+            created = bulk_create(orders, *args, **kwargs)
+            for order in orders:
+                order.pk = None
+            return created
+
+        Order.objects.create(company=self.company, product=self.product, quantity=1, created_by=self.admin)
+        with mock.patch.object(Order.objects, 'bulk_create', without_ids):
+            created, failed = OrderMixin.create_orders(
+                [{'product': self.other_product, 'quantity': 2}, {'product': self.product, 'quantity': 3}],
+                self.operator,
+            )
+        self.assertEqual(failed, [])
+        for order in created:
+            stored = Order.objects.get(pk=order.pk)
+            self.assertEqual((stored.product_id, stored.quantity, stored.created_by_id),
+                             (order.product_id, order.quantity, self.operator.pk))
+        self.assertEqual(
+            set(StockMovement.objects.filter(reason='order_created').values_list('order_id', flat=True)),
+            {order.pk for order in created},
+        )
+
+    def test_ids_read_back_must_match_the_insert(self):
+        bulk_create = Order.objects.bulk_create
+
+        def without_ids_and_a_stranger(orders, *args, **kwargs):
+            created = bulk_create(orders, *args, **kwargs)
+            for order in orders:
+                order.pk = None
+            Order.objects.create(company=self.company, product=self.product, quantity=1, created_by=self.operator)
+            return created
+
+        with mock.patch.object(Order.objects, 'bulk_create', without_ids_and_a_stranger):
+            with self.assertRaises(RuntimeError):
+                OrderMixin.create_orders([{'product': self.product, 'quantity': 3}], self.operator)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(StockMovement.objects.filter(reason='order_created').exists())
+
+
+class IdempotencyTests(TenantTestCase):
+
+    def post(self, lines, key='retry-1'):
+        return self.client.post('/api/orders/', json.dumps(lines), content_type='application/json',
+                                headers={'Idempotency-Key': key})
+
+    def test_replay_creates_nothing(self):
+        lines = [{'product': self.product.pk, 'quantity': 2}]
+        first = self.post(lines)
+        self.assertEqual(first.status_code, 201)
+        for _ in range(2): # from the in-process cache, then from the table
+            replayed = self.post(lines)
+            self.assertEqual((replayed.status_code, replayed.json()), (201, first.json()))
+            self.assertEqual(replayed.headers['Idempotent-Replayed'], 'true')
+            idempotency.recent_keys.clear()
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Product.objects.get(pk=self.product.pk).stock, 98)
+
+    def test_key_reused_with_another_body_is_422(self):
+        self.assertEqual(self.post([{'product': self.product.pk, 'quantity': 2}]).status_code, 201)
+        response = self.post([{'product': self.product.pk, 'quantity': 3}])
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_keys_are_per_company(self):
+        self.assertEqual(self.post([{'product': self.product.pk, 'quantity': 2}]).status_code, 201)
+        self.client.force_login(self.other_operator)
+        response = self.post([{'product': self.product.pk, 'quantity': 2}])
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+
+
+class CatalogETagTests(TenantTestCase):
+
+    def test_not_modified_until_the_catalog_changes(self):
+        first = self.client.get('/api/products/')
+        self.assertEqual(first.status_code, 200)
+        etag = first.headers['ETag']
+        self.assertEqual({p['name'] for p in json.loads(first.content)}, {"Widget", "Gadget"})
+
+        cached = self.client.get('/api/products/', headers={'If-None-Match': etag})
+        self.assertEqual((cached.status_code, cached.headers['ETag']), (304, etag))
+
+        with self.captureOnCommitCallbacks(execute=True): # the version bump waits for the commit
+            OrderMixin.create_orders([{'product': self.product, 'quantity': 1}], self.operator)
+        changed = self.client.get('/api/products/', headers={'If-None-Match': etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.assertIn(99, [p['stock'] for p in json.loads(changed.content)])
+
+        self.client.force_login(self.other_operator)
+        self.assertEqual(self.client.get('/api/products/', headers={'If-None-Match': etag}).status_code, 200)
+
+
+class ExportDownloadTests(TenantTestCase):
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings = override_settings(EXPORT_ROOT=root, EXPORT_SETTLE_SECONDS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        OrderMixin.create_orders([{'product': self.product, 'quantity': q} for q in range(1, 6)], self.operator)
+        self.job = exports.queue_export(self.company.pk, self.operator)
+        self.assertTrue(exports.write_export(self.job, chunk_size=2))
+        self.url = f'/api/orders/exports/{self.job.pk}/download/'
+        with open(exports.export_path(self.job), 'rb') as f:
+            self.body = f.read()
+
+    def get(self, **headers):
+        response = self.client.get(self.url, headers=headers)
+        return response, b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_whole_file_and_ranges(self):
+        response, body = self.get()
+        self.assertEqual((response.status_code, body), (200, self.body))
+        self.assertEqual(body.count(b'\n'), 6) # header + 5 orders
+        etag = response.headers['ETag']
+
+        size = len(self.body)
+        for header, start, end in (('bytes=10-', 10, size - 1), ('bytes=0-9', 0, 9), ('bytes=-7', size - 7, size - 1),
+                                   (f'bytes=5-{size + 100}', 5, size - 1)):
+            response, body = self.get(Range=header, **{'If-Range': etag})
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(body, self.body[start:end + 1], header)
+            self.assertEqual(response.headers['Content-Range'], f'bytes {start}-{end}/{size}')
+
+    def test_unsatisfiable_and_stale_ranges(self):
+        response, _ = self.get(Range=f'bytes={len(self.body)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers['Content-Range'], f'bytes */{len(self.body)}')
+        response, body = self.get(Range='bytes=10-', **{'If-Range': '"another-file"'})
+        self.assertEqual((response.status_code, body), (200, self.body))
+
+    def test_malformed_ranges_are_ignored(self):
+        for header in ('bytes=9-3', 'bytes=-', 'bytes=1-2,5-6', 'lines=1-2', 'bytes=a-'):
+            response, body = self.get(Range=header)
+            self.assertEqual((response.status_code, body), (200, self.body), header)
+
+    def test_expired_files_are_deleted(self):
+        path = exports.export_path(self.job)
+        failed = exports.queue_export(self.company.pk, self.operator)
+        ExportJob.objects.filter(pk=failed.pk).update(status='failed', finished_at=timezone.now())
+        self.assertEqual(exports.expire_exports(), (0, 0))
+
+        later = timezone.now() + timedelta(days=8)
+        self.assertEqual(exports.expire_exports(later), (1, 1))
+        self.assertFalse(ExportJob.objects.filter(pk=failed.pk).exists())
+        self.assertEqual(ExportJob.objects.get(pk=self.job.pk).status, 'expired')
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_file_removed_after_lookup_is_404(self):
+        os.remove(exports.export_path(self.job))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_queue_needs_an_object(self):
+        response = self.client.post('/api/orders/exports/', '[1]', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/orders/exports/', {'format': 'ndjson'}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+
+    def test_since_last_starts_after_the_last_finished_export(self):
+        queued = exports.queue_export(self.company.pk, self.operator) # may still fail, must not move the start
+        job = exports.queue_export(self.company.pk, self.operator, since_last=True)
+        self.assertEqual(job.created_after, self.job.created_before)
+        ExportJob.objects.filter(pk=queued.pk).update(status='done')
+        job = exports.queue_export(self.company.pk, self.operator, since_last=True)
+        self.assertEqual(job.created_after, queued.created_before)
+
+    def test_admin_select_all_stores_the_filters(self):
+        self.admin.is_superuser = self.admin.is_staff = True
+        self.admin.save()
+        self.client.force_login(self.admin)
+        Order.objects.filter(quantity__in=(2, 4)).update(status='success')
+        response = self.client.post('/admin/orders/order/?status__exact=success', {
+            'action': 'export_orders_as_csv', 'select_across': '1', '_selected_action': ['1'],
+        })
+        self.assertEqual(response.status_code, 302)
+        job = ExportJob.objects.latest('created_at')
+        self.assertEqual(job.filters, {'status__exact': 'success'})
+        self.assertEqual(sorted(row[2] for chunk in exports.job_chunks(job) for row in chunk), [2, 4])
+
+        count = ExportJob.objects.count()
+        response = self.client.post('/admin/orders/order/?q=5', {
+            'action': 'export_orders_as_csv', 'select_across': '1', '_selected_action': ['1'],
+        }, follow=True)
+        self.assertContains(response, "Can&#x27;t export all orders matching q")
+        self.assertEqual(ExportJob.objects.count(), count)
+
+        picked = list(Order.objects.filter(quantity__in=(1, 5)).values_list('id', flat=True))
+        self.client.post('/admin/orders/order/', {'action': 'export_orders_as_csv', '_selected_action': picked})
+        job = ExportJob.objects.latest('created_at')
+        self.assertEqual(sorted(job.filters['id__in']), sorted(picked))
+        self.assertEqual(sum(len(chunk) for chunk in exports.job_chunks(job)), 2)
+
+    def test_other_company_cannot_download(self):
+        self.client.force_login(self.other_operator)
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class OrderExportFormatTests(TenantTestCase):
+
+    def test_formats(self):
+        OrderMixin.create_orders([{'product': self.product, 'quantity': 2}], self.operator)
+        response = self.client.get('/api/orders/export/')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'text/csv'))
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.splitlines()[1].split(',')[1:4], ["Widget", "2", "pending"])
+
+        response = self.client.get('/api/orders/export/?format=ndjson')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['quantity'], 2)
+        # a client that only says it accepts JSON still gets the default csv
+        response = self.client.get('/api/orders/export/', headers={'Accept': 'application/json'})
+        self.assertEqual(response['Content-Type'], 'text/csv')
+
+    def test_unknown_format_is_400(self):
+        for fmt in ('json', 'xlsx', 'api'):
+            response = self.client.get(f'/api/orders/export/?format={fmt}')
+            self.assertEqual(response.status_code, 400, fmt)
+            self.assertEqual(response.json(), {"error": f"Unknown format {fmt!r}, use one of csv, ndjson, arrow, parquet"})
+
+
+class ReconcileStockTests(TenantTestCase):
+
+    def reconcile(self, *args):
+        out = StringIO()
+        call_command('reconcile_stock', '--settle', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_ledger_matches_and_drift_is_reported(self):
+        OrderMixin.create_orders([{'product': self.product, 'quantity': 3}], self.operator)
+        self.assertIn("0 drifting", self.reconcile())
+
+        Product.objects.filter(pk=self.other_product.pk).update(stock=40) # changed behind the ledger's back
+        OrderMixin.create_orders([{'product': self.other_product, 'quantity': 1}], self.operator)
+        output = self.reconcile()
+        self.assertIn(f"product {self.other_product.pk}: stock 39, ledger says 49 (-10)", output)
+        self.assertIn("1 drifting", output)
+        with self.assertRaises(CommandError):
+            self.reconcile('--full', '--fail-on-drift')
+
+
+class IngestTests(TransactionTestCase):
+    """the batch runs on the ingest pool's own connections, so the rows have to be committed"""
+
+    def setUp(self):
+        self.company = Company.objects.create(name="Company A")
+        self.operator = User.objects.create(username="operator_a", role='operator', company=self.company)
+        self.product = Product.objects.create(company=self.company, name="Widget", price=Decimal('10.00'), stock=100)
+
+    def queue(self, lines):
+        return IngestJob.objects.create(company=self.company, created_by=self.operator, lines=lines)
+
+    async def test_accepted_then_polled_until_done(self):
+        await self.async_client.aforce_login(self.operator)
+        response = await self.async_client.post(
+            '/api/orders/async/', [{'product': self.product.pk, 'quantity': 3}], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        body = response.json()
+        self.assertEqual(body['status'], 'queued')
+        await asyncio.gather(*ingest._in_flight)
+
+        await self.client.aforce_login(self.operator)
+        job = await sync_to_async(self.client.get)(body['status_url'])
+        job = job.json()
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual([(o['product'], o['quantity']) for o in job['result']['created']], [(self.product.pk, 3)])
+
+        response = await self.async_client.post(
+            '/api/orders/async/', [{'product': self.product.pk, 'quantity': 0}], content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_refused_under_wsgi(self):
+        self.client.force_login(self.operator)
+        response = self.client.post('/api/orders/async/', [], content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+    def test_a_job_is_claimed_once(self):
+        job = self.queue([{'product': self.product.pk, 'quantity': 1}])
+        self.assertTrue(ingest.claim(job))
+        self.assertFalse(ingest.claim(IngestJob.objects.get(pk=job.pk)))
+        ingest.run(IngestJob.objects.get(pk=job.pk), self.operator) # a second runner does nothing
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_stale_running_job_is_recovered(self):
+        job = self.queue([{'product': self.product.pk, 'quantity': 2}])
+        long_ago = timezone.now() - timedelta(seconds=settings.INGEST_JOB_TIMEOUT + 1)
+        IngestJob.objects.filter(pk=job.pk).update(status='running', started_at=long_ago, created_at=long_ago)
+        fresh = self.queue([{'product': self.product.pk, 'quantity': 1}]) # still within the grace period
+        self.assertEqual([j.pk for j in ingest.lost_jobs()], [job.pk])
+
+        out = StringIO()
+        call_command('run_ingest_jobs', '--once', stdout=out)
+        self.assertIn(f"ingest job {job.pk} recovered: done", out.getvalue())
+        self.assertEqual(Order.objects.get().quantity, 2)
+        self.assertEqual(IngestJob.objects.get(pk=fresh.pk).status, 'queued')
@@ -1,9 +1,23 @@
-from .views import ProductView, OrderView, order_export_view
+from .ingest import order_ingest_view
+from .views import (
+    ProductView, ProductImportView, OrderView, IngestJobView, ExportJobView, AnalyticsView, TokenView, OrderExportView,
+    export_download_view,
+)
 from django.urls import path
+from .profiling import metrics_view
 
 urlpatterns = [
     path('products/', ProductView.as_view(), name='product-list-delete'),
+    path('products/import/', ProductImportView.as_view(), name='product-import'),
     path('orders/', OrderView.as_view(), name='order-create-update'), 
     path('orders/<int:pk>/', OrderView.as_view()), # PATCH/PUT
-    path('orders/export/', order_export_view, name='order-export'), 
+    path('orders/export/', OrderExportView.as_view(), name='order-export'), 
+    path('orders/exports/', ExportJobView.as_view(), name='export-queue'),
+    path('orders/exports/<uuid:job_id>/', ExportJobView.as_view(), name='export-job'),
+    path('orders/exports/<uuid:job_id>/download/', export_download_view, name='export-download'),
+    path('orders/async/', order_ingest_view, name='order-ingest'),
+    path('orders/jobs/<uuid:job_id>/', IngestJobView.as_view(), name='ingest-job'),
+    path('analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('auth/token/', TokenView.as_view(), name='api-token'),
 ]
@@ -1,108 +1,323 @@
+from django.conf import settings
 from django.db import transaction
-from django.db.models import F
+from django.db.models import Case, F, PositiveIntegerField, When
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from rest_framework.exceptions import ValidationError
-from .models import Order, Product
-import csv
-import logging
+from .cache import invalidate_catalog
+from .formats import EXPORT_FIELDS, encode_chunks, get_encoder
+from .models import DailySalesRollup, NotificationOutbox, Order, Product, StockMovement
+from .profiling import allow_queries
+from collections import defaultdict
 
 class OrderMixin:
 
     @staticmethod
     @transaction.atomic
     def create_order(data, user):
-        try:
-            product = Product.active_objects.select_for_update().get(
-                id=data["product"],
-                company=user.company
-            )
-        except Product.DoesNotExist:
-            return data["product"]
-            # raise ValidationError("Product isn,t belong to your company")
-        
         quantity = data["quantity"]
-        if product.stock < quantity:
-            return product
-            # raise ValidationError("not enough stock")
+        product_id = product_pk(data["product"])
+
+        if conditional_reservation():
+            if not reserve_stock(product_id, user.company_id, quantity):
+                return product_id
+        else:
+            # the product was loaded by validation, only its stock is read again, under the lock
+            stock = Product.active_objects.select_for_update().filter(
+                id=product_id,
+                company_id=user.company_id
+            ).values_list('stock', flat=True).first()
+            if stock is None:
+                return product_id
+                # raise ValidationError("Product isn,t belong to your company")
+
+            if stock < quantity:
+                return product_id
+                # raise ValidationError("not enough stock")
+
+            Product.objects.filter(id=product_id).update(stock=F('stock') - quantity, last_updated_at=timezone.now())
 
-        product.stock = F('stock') - quantity
-        product.save()
+        invalidate_catalog(user.company_id)
         order = Order.objects.create(
-            company=user.company,
-            product=product,
+            company_id=user.company_id,
+            product_id=product_id,
             quantity=quantity,
+            unit_price=getattr(data["product"], "price", None), # None: save() reads it
             status="pending",
             created_by=user
         )
-        logging.getLogger("orders.confirmation").info(
-                "Order created: order_id=%s user=%s company=%s product=%s qty=%s",
-                order.id, user.id, user.company.id, order.product.id, order.quantity
-            )
+        StockMovement.record(
+            'order_created', company_id=user.company_id, product_id=product_id, order_id=order.id, delta=-quantity
+        )
+        NotificationOutbox.enqueue(
+            'order_created', order_id=order.id, user=user.id, company=user.company_id,
+            product=order.product_id, qty=order.quantity
+        )
         return order
 
 
+    @staticmethod
+    @transaction.atomic
+    def create_orders(lines, user):
+        """
+        Set-based create_order for a whole batch, returns (created_orders, failed_product_ids).
+
+        With the default locking strategy all referenced products are locked in one query
+        (always in id order, so two batches can't deadlock each other), stock is checked in
+        memory line by line, then the decrements go out as one grouped UPDATE. With the
+        conditional strategy see _reserve_lines. Either way the orders are one INSERT.
+        """
+        company_id = user.company_id
+        prices = {line["product"].pk: line["product"].price for line in lines if isinstance(line["product"], Product)}
+        lines = [{**line, "product": product_pk(line["product"])} for line in lines]
+        if conditional_reservation():
+            accepted, locked_at = _reserve_lines(lines, company_id)
+        else:
+            accepted, locked_at = _lock_and_reserve_lines(lines, company_id)
+
+        orders, failed = [], []
+        for index, line in enumerate(lines):
+            if index not in accepted:
+                failed.append(line["product"])
+                continue
+            orders.append(Order(
+                company_id=company_id,
+                product_id=line["product"],
+                quantity=line["quantity"],
+                status="pending",
+                created_by=user
+            ))
+
+        if not orders:
+            return orders, failed
+
+        missing = {order.product_id for order in orders} - prices.keys() # lines sent as bare ids (ingest jobs)
+        if missing:
+            prices.update(Product.objects.filter(id__in=missing).values_list('id', 'price'))
+        for order in orders:
+            order.unit_price = prices[order.product_id]
+
+        invalidate_catalog(company_id)
+        _bulk_insert_orders(orders, locked_at)
+        DailySalesRollup.record(
+            (company_id, order.product_id, order.created_at, order.status, 1, order.quantity,
+             order.quantity * order.unit_price)
+            for order in orders
+        )
+        StockMovement.record_many('order_created', [
+            {'company_id': company_id, 'product_id': order.product_id, 'order_id': order.pk, 'delta': -order.quantity}
+            for order in orders
+        ])
+
+        NotificationOutbox.enqueue_many('order_created', [
+            {'order_id': order.id, 'user': user.id, 'company': company_id,
+             'product': order.product_id, 'qty': order.quantity}
+            for order in orders
+        ])
+        return orders, failed
+
     @staticmethod
     @transaction.atomic
     def update_order(order, data, user):
+        # lock the row and edit it as it is now, so two concurrent edits can't both start from the
+        # same state and count their rollup / notification deltas twice
+        order = Order.objects.select_for_update().get(pk=order.pk)
         if order.created_at.date() != timezone.now().date():
             raise ValidationError("Can't edit old orders")
         
         if not "product" in data:
-            data["product"] = order.product.id
+            data["product"] = order.product_id
+        new_product_id = product_pk(data["product"])
 
         if not "quantity" in data:
             raise ValidationError("Quantity is required")
 
-        old_product = Product.active_objects.select_for_update().get(id=order.product_id)
-
-        try:
-            new_product = Product.active_objects.select_for_update().get(
-                id=data["product"], 
-                company=user.company
-            )
-        except Product.DoesNotExist:
-            raise ValidationError("Product isn,t belong to your company")
-
         old_qty = order.quantity
+        old_product_id = order.product_id
         new_qty = data["quantity"]
 
-        old_product.stock = F('stock') + old_qty
-        old_product.save()
+        if conditional_reservation():
+            def reserve():
+                if not reserve_stock(new_product_id, user.company_id, new_qty):
+                    raise ValidationError("not enough stock")
 
-        if new_product.stock < new_qty:
-            raise ValidationError("not enough stock")
+            def release():
+                release_stock(order.product_id, old_qty)
 
-        new_product.stock = F('stock') - new_qty
-        new_product.save()
-        order.product = new_product
-        order.quantity = data.get("quantity", order.quantity)
-        order.save()
+            # touch the two rows in product id order, the same order every other writer uses
+            for step in ((reserve, release) if new_product_id < order.product_id else (release, reserve)):
+                step()
+            invalidate_catalog(user.company_id)
+            order.product_id = new_product_id
+        else:
+            old_product = Product.active_objects.select_for_update().get(id=order.product_id)
 
+            try:
+                new_product = Product.active_objects.select_for_update().get(
+                    id=new_product_id, 
+                    company_id=user.company_id
+                )
+            except Product.DoesNotExist:
+                raise ValidationError("Product isn,t belong to your company")
 
-        logging.getLogger("orders.confirmation").info(
-                "Order %s for company %s had update by %s. product=%s qty=%s",
-                order.id, user.company.id, user.id, order.product.id, order.quantity
-            )
-        return order
+            old_product.stock = F('stock') + old_qty
+            old_product.save()
+
+            if new_product.stock < new_qty:
+                raise ValidationError("not enough stock")
+
+            new_product.stock = F('stock') - new_qty
+            new_product.save()
+            invalidate_catalog(old_product.company_id, new_product.company_id)
+            if new_product.pk != old_product_id:
+                order.unit_price = new_product.price
+            order.product = new_product
 
-def export_order_util(orders):
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="orders.csv"'
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'Product', 'Quantity', 'Status', 'Shipped At', 'Created At'])
-
-    for order in orders:
-        product_name = order.product.name 
-        shipped_at = order.shipped_at.isoformat() 
-        created_at = order.created_at.isoformat()
-        writer.writerow([
-            order.id,
-            product_name,
-            order.quantity,
-            order.status,
-            shipped_at,
-            created_at
+        order.quantity = new_qty
+        order.save()
+        StockMovement.record_many('order_updated', [
+            {'company_id': user.company_id, 'product_id': old_product_id, 'order_id': order.id, 'delta': old_qty},
+            {'company_id': user.company_id, 'product_id': order.product_id, 'order_id': order.id, 'delta': -new_qty},
         ])
 
+        NotificationOutbox.enqueue(
+            'order_updated', order_id=order.id, company=user.company_id, user=user.id,
+            product=order.product_id, qty=order.quantity
+        )
+        return order
+
+def product_pk(product):
+    """order lines carry the Product validated by OrderSerializer, or just its id (ingest jobs, benchmarks)"""
+    return getattr(product, 'pk', product)
+
+
+def conditional_reservation():
+    return settings.STOCK_RESERVATION == 'conditional'
+
+
+def reserve_stock(product_id, company_id, quantity, now=None):
+    """
+    UPDATE ... SET stock = stock - q WHERE id = ? AND stock >= q, True when the row was there
+    to take from. nothing is read or locked beforehand, the row lock only lives from this
+    statement to the commit.
+    """
+    return Product.active_objects.filter(id=product_id, company_id=company_id, stock__gte=quantity).update(
+        stock=F('stock') - quantity, last_updated_at=now or timezone.now()
+    ) == 1
+
+
+def release_stock(product_id, quantity, now=None):
+    Product.objects.filter(id=product_id).update(
+        stock=F('stock') + quantity, last_updated_at=now or timezone.now()
+    )
+
+
+def _lock_and_reserve_lines(lines, company_id):
+    """locking strategy of create_orders, returns (indexes of accepted lines, time the locks were taken)"""
+    stock = dict(
+        Product.active_objects.select_for_update()
+        .filter(id__in={line["product"] for line in lines}, company_id=company_id)
+        .order_by('id').values_list('id', 'stock')
+    )
+    locked_at = timezone.now()
+
+    reserved = defaultdict(int)
+    accepted = set()
+    for index, line in enumerate(lines):
+        product_id, quantity = line["product"], line["quantity"]
+        if stock.get(product_id, -1) < quantity:
+            continue
+        stock[product_id] -= quantity
+        reserved[product_id] += quantity
+        accepted.add(index)
+
+    if reserved:
+        Product.objects.filter(id__in=reserved).update(
+            stock=Case(
+                *[When(id=pid, then=F('stock') - qty) for pid, qty in reserved.items()],
+                default=F('stock'),
+                output_field=PositiveIntegerField()
+            ),
+            last_updated_at=locked_at
+        )
+    return accepted, locked_at
+
+
+def _reserve_lines(lines, company_id):
+    """
+    conditional strategy of create_orders: one conditional UPDATE per product for its whole
+    requested quantity (in id order), and only when that fails line by line for that product.
+    """
+    by_product = defaultdict(list)
+    for index, line in enumerate(lines):
+        by_product[line["product"]].append(index)
+
+    now = timezone.now()
+    accepted = set()
+
+    def reserve(product_id, quantity):
+        allow_queries(1) # these statements grow with the batch, they aren't part of the view's budget
+        return reserve_stock(product_id, company_id, quantity, now)
+
+    for product_id in sorted(by_product):
+        indexes = by_product[product_id]
+        if reserve(product_id, sum(lines[i]["quantity"] for i in indexes)):
+            accepted.update(indexes)
+            continue
+        if len(indexes) > 1:
+            accepted.update(i for i in indexes if reserve(product_id, lines[i]["quantity"]))
+    # rows are locked by our UPDATEs until commit from here on
+    return accepted, timezone.now()
+
+
+def _bulk_insert_orders(orders, since):
+    """bulk_create the orders and make sure every instance ends up with its pk"""
+    Order.objects.bulk_create(orders)
+    if orders[0].pk is not None:
+        return
+    # MySQL can't return ids from a multi-row INSERT. The caller still holds the row
+    # locks on these products (taken by SELECT FOR UPDATE or by the conditional UPDATEs), so the only orders for them created since the locks
+    # were taken are the ones just inserted, and ids grow in insert order.
+    first = orders[0]
+    ids = list(Order.objects.filter(
+        company_id=first.company_id,
+        created_by_id=first.created_by_id,
+        product_id__in={o.product_id for o in orders},
+        created_at__gte=since,
+    ).order_by('id').values_list('id', flat=True))
+    if len(ids) != len(orders):
+        # pairing them up anyway would hang the ledger, rollups and outbox rows on the wrong orders
+        raise RuntimeError(f"read back {len(ids)} order ids for {len(orders)} inserted orders")
+    for order, pk in zip(orders, ids):
+        order.pk = pk
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+def iter_order_chunks(orders, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield lists of EXPORT_FIELDS tuples for ``orders`` in primary-key chunks.
+
+    Every chunk is a fresh ``pk > last_pk`` query with the product name joined in,
+    so memory stays constant and it behaves the same on MySQL (whose driver buffers
+    the whole result set even for .iterator()) as on backends with real cursors.
+    """
+    orders = orders.order_by('pk').values_list(*EXPORT_FIELDS)
+    last_pk = 0
+    while True:
+        chunk = list(orders.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1][0]
+
+
+def export_order_util(orders, filename='orders', fmt='csv'):
+    """stream ``orders`` as ``fmt`` (see orders.formats), raises ValueError for an unusable format"""
+    encoder = get_encoder(fmt)
+    response = StreamingHttpResponse(
+        encode_chunks(encoder, iter_order_chunks(orders)), content_type=encoder.content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{encoder.extension}"'
     return response
@@ -1,17 +1,41 @@
 from rest_framework import generics, status
+from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes 
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.urls import reverse
 from django.utils import timezone
-from .models import Order, Product
+from django.utils.dateparse import parse_date
+from datetime import timedelta
+from . import analytics, exports, idempotency
+from .cache import get_catalog, invalidate_catalog
+from .authentication import issue_token, revoke_token
+from .fast_serializers import fast_orders, fast_products
+from .formats import ENCODERS, EXPORT_RENDERERS, ExportNegotiation
+from .models import ExportJob, IngestJob, Order, Product
+from .parsers import CSVParser
+from .product_import import import_products
 from .serializers import ProductSerializer, ProductDeleteSerializer, OrderSerializer
 from .permessions import IsAdmin, IsOperator, IsAdminOrOperator
 from .utils import OrderMixin, export_order_util
+from .pagination import CreatedAtCursorPagination, filter_created_range
+from .profiling import query_budget, timed
+from .tenancy import TenantViewMixin, get_tenant
 from django.db import transaction
 
-class ProductView(generics.GenericAPIView):
+@query_budget(5)
+class ProductView(TenantViewMixin, generics.GenericAPIView):
     """
     GET /api/products/ — List all active products for the user's company
+     cached per company and sent with an ETag, send it back in If-None-Match to get a 304
+
+    GET /api/products/?page_size=50&created_after=2025-11-01 — cursor paginated listing (newest first)
+     sending any of page_size, cursor, created_after, created_before switches to the paginated form:
+        {"next": "<url with ?cursor=...>", "previous": null, "results": [...]}
      request body example:
 
         [
@@ -53,6 +77,8 @@ class ProductView(generics.GenericAPIView):
     queryset = Product.active_objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = CreatedAtCursorPagination
+    list_params = ('page_size', 'cursor', 'created_after', 'created_before')
 
     def get_permissions(self):
         if self.request.method == 'DELETE':
@@ -60,8 +86,7 @@ class ProductView(generics.GenericAPIView):
         return super().get_permissions()
 
     def get_queryset(self):
-        user = self.request.user
-        return Product.active_objects.filter(company=user.company)
+        return Product.active_objects.for_tenant(self.tenant)
 
     def get_serializer_class(self):
         if self.request.method == 'DELETE':
@@ -69,9 +94,18 @@ class ProductView(generics.GenericAPIView):
         return super().get_serializer_class()
 
     def get(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        if any(param in request.query_params for param in self.list_params):
+            queryset = filter_created_range(self.get_queryset(), request.query_params)
+            page = self.paginate_queryset(queryset)
+            with timed('serializer'):
+                data = fast_products.data_from_instances(page)
+            return self.get_paginated_response(data)
+
+        # served from the per-company catalog cache, no queryset or serializer on a hit
+        etag, body = get_catalog(self.tenant.company_id)
+        if etag in request.headers.get('If-None-Match', ''):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        return HttpResponse(body, content_type='application/json', headers={'ETag': etag})
     
     def delete(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -80,16 +114,46 @@ class ProductView(generics.GenericAPIView):
 
         ids = serializer.validated_data['ids']
 
+        # a plain UPDATE: it locks the rows itself, waiting for order transactions holding them in
+        # either reservation strategy (a select_for_update() before .update() never reaches the SQL)
         with transaction.atomic():
-            deleted_count = self.get_queryset().select_for_update(nowait=True).filter(id__in=ids)\
-                            .update(is_active=False, last_updated_at=timezone.now())
+            deleted_count = self.get_queryset().filter(id__in=ids).update(is_active=False, last_updated_at=timezone.now())
+            invalidate_catalog(self.tenant.company_id)
 
         return Response(
             {'message': f'{deleted_count} product(s) deleted successfully'},
             status=status.HTTP_200_OK
         )
 
-class OrderView(generics.GenericAPIView, OrderMixin):
+class ProductImportView(TenantViewMixin, APIView):
+    """
+    POST /api/products/import/ — Create or update products of the admin's company in bulk (admin only)
+     a JSON list, or a CSV body (Content-Type: text/csv) with a name,price,stock[,is_active] header row.
+     rows are matched on name: existing products get the new price/stock/is_active, the rest are created.
+
+        [
+            {"name": "Company 3 Product 1", "price": "384.39", "stock": 18},
+            {"name": "Company 3 Product 99", "price": "12.00", "stock": 0, "is_active": false}
+        ]
+
+     response: valid rows are imported even when others fail, rows count from 1
+        {"created": 1, "updated": 1, "errors": [{"row": 3, "errors": {"price": ["A valid number is required."]}}]}
+    """
+    permission_classes = [IsAdmin]
+    parser_classes = [JSONParser, CSVParser]
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list) or not rows:
+            return Response({"error": "Send a non empty list of products"}, status=400)
+        report = import_products(rows, self.tenant.company_id, request.user, settings.PRODUCT_IMPORT_BATCH_SIZE)
+        return Response(report, status=200)
+
+
+# POST: 12, +7 with an Idempotency-Key, +1 on MySQL to read back the order ids; the conditional
+# strategy's per product UPDATEs come on top through allow_queries. PATCH: 17
+@query_budget(20)
+class OrderView(TenantViewMixin, generics.GenericAPIView, OrderMixin):
     """
     POST /api/orders/ — Create one or more orders
      request body example:
@@ -102,42 +166,83 @@ class OrderView(generics.GenericAPIView, OrderMixin):
         
         {"product": 15, "quantity": 3},
 
+     send an Idempotency-Key header to make retries safe: a repeated key gets the first
+     response back (with Idempotent-Replayed: true) and creates nothing, for 24h by default
+
     PATCH/PUT /api/orders/<id>/ — Edit an order (operator can edit only today's orders)
+
+    GET /api/orders/ — Cursor paginated list of the company's orders (newest first)
+     filters: ?status=pending&product=15&created_after=2025-11-01&created_before=2025-11-15T12:00
+     paging:  ?page_size=100, then follow "next"
     
     """
 
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAdminOrOperator]
+    pagination_class = CreatedAtCursorPagination
+
+    def get_queryset(self):
+        return Order.objects.for_tenant(self.tenant)
 
     def get_permissions(self):
         if self.request.method in ("PUT", "PATCH"):
             return [IsOperator()]
+        if self.request.method == "GET":
+            return [IsAuthenticated()]
         return super().get_permissions()
 
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        orders = self.get_queryset()
+        orders = filter_created_range(orders, params)
+
+        if params.get('status'):
+            if params['status'] not in dict(Order.STATUS_CHOICES):
+                return Response({"error": "Unknown status"}, status=400)
+            orders = orders.filter(status=params['status'])
+        if params.get('product'):
+            if not params['product'].isdigit():
+                return Response({"error": "product must be an id"}, status=400)
+            orders = orders.filter(product_id=params['product'])
+
+        page = self.paginate_queryset(orders)
+        with timed('serializer'):
+            data = fast_orders.data_from_instances(page)
+        return self.get_paginated_response(data)
+
     def post(self, request):
         data = request.data
     
         if isinstance(data, dict):
             data = [data]
 
+        key = request.headers.get(idempotency.HEADER)
+        if key:
+            if len(key) > 255:
+                return Response({"error": f"{idempotency.HEADER} is longer than 255 characters"}, status=400)
+            digest = idempotency.request_hash(data)
+            replayed = idempotency.replay(self.tenant.company_id, key, digest)
+            if replayed is not None: # a retry, answered before validation touches any product
+                return replayed
+
         serializer = self.get_serializer(data=data, many=True)
-        serializer.is_valid(raise_exception=True)
+        with timed('serializer'):
+            serializer.is_valid(raise_exception=True)
 
-        created_orders = []
-        failed = []
-        user = request.user
+        if key:
+            return idempotency.run_once(
+                self.tenant.company_id, key, digest, lambda: self.create_response(serializer.validated_data)
+            )
+        return self.create_response(serializer.validated_data)
 
-        with transaction.atomic():
-            for order_data in serializer.validated_data:
-                order = self.create_order(order_data, user)
-                if order and isinstance(order, Order):
-                    created_orders.append(order)
-                else:
-                    failed.append(order_data.get('product'))
+    def create_response(self, lines):
+        created_orders, failed = self.create_orders(lines, self.request.user)
 
+        with timed('serializer'):
+            created = fast_orders.data_from_instances(created_orders)
         return Response({
-            "created": OrderSerializer(created_orders, many=True).data,
+            "created": created,
             "failed_products": failed
         }, status=201)
     
@@ -147,7 +252,7 @@ class OrderView(generics.GenericAPIView, OrderMixin):
         if not pk:
             return Response({"error": "Order ID is required"}, status=400)
 
-        order = self.get_queryset().filter(id=pk,company=self.request.user.company).first()
+        order = self.get_queryset().filter(id=pk).first()
         if not order:
             return Response({"error": "Order not found"}, status=404)
         
@@ -164,7 +269,7 @@ class OrderView(generics.GenericAPIView, OrderMixin):
         if not pk:
             return Response({"error": "Order ID is required"}, status=400)
 
-        order = self.get_queryset().filter(id=pk,company=self.request.user.company).first()
+        order = self.get_queryset().filter(id=pk).first()
         if not order:
             return Response({"error": "Order not found"}, status=404)
         
@@ -176,16 +281,174 @@ class OrderView(generics.GenericAPIView, OrderMixin):
 
     
 
+class IngestJobView(TenantViewMixin, APIView):
+    """
+    GET /api/orders/jobs/<id>/ — State of a batch queued with POST /api/orders/async/
+     {"id": "...", "status": "queued|running|done|failed", "result": {"created": [...], "failed_products": [...]}, ...}
+    """
+    permission_classes = [IsAdminOrOperator]
+
+    def get(self, request, job_id):
+        job = IngestJob.objects.filter(pk=job_id, company_id=self.tenant.company_id).first()
+        if not job:
+            return Response({"error": "Job not found"}, status=404)
+        return Response({
+            "id": str(job.pk),
+            "status": job.status,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+        })
+
+
+class ExportJobView(TenantViewMixin, APIView):
+    """
+    POST /api/orders/exports/ — Queue a background export of the company's orders
+     request body (all optional): {"format": "parquet", "gzip": true, "since_last": true}
+     format is one of csv (default), ndjson, arrow, parquet, as for GET /api/orders/export/
+     since_last only exports orders created after the company's previous export
+     response 202: {"id": "...", "status": "queued", "status_url": "/api/orders/exports/<id>/"}
+
+    GET /api/orders/exports/<id>/ — Job state, with rows written so far
+    GET /api/orders/exports/<id>/download/ — The file once done, supports Range for resuming
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get_job(self, job_id):
+        return ExportJob.objects.filter(pk=job_id, company_id=self.tenant.company_id).first()
+
+    def post(self, request):
+        if not isinstance(request.data, dict):
+            return Response({"error": "Send a JSON object"}, status=400)
+        try:
+            job = exports.queue_export(
+                self.tenant.company_id, request.user, fmt=request.data.get('format') or 'csv',
+                compress=bool(request.data.get('gzip')), since_last=bool(request.data.get('since_last')),
+            )
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
+        return Response({
+            "id": str(job.pk),
+            "status": job.status,
+            "status_url": reverse('export-job', args=[job.pk]),
+        }, status=202)
+
+    def get(self, request, job_id):
+        job = self.get_job(job_id)
+        if not job:
+            return Response({"error": "Export not found"}, status=404)
+        return Response({
+            "id": str(job.pk),
+            "status": job.status,
+            "format": job.format,
+            "gzip": job.gzip,
+            "created_after": job.created_after,
+            "created_before": job.created_before,
+            "rows": job.rows,
+            "size": job.size,
+            "error": job.error,
+            "download_url": reverse('export-download', args=[job.pk]) if job.status == 'done' else None,
+            "created_at": job.created_at,
+            "finished_at": job.finished_at,
+        })
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def order_export_view(request):
+def export_download_view(request, job_id):
+    job = ExportJob.objects.filter(pk=job_id, company_id=get_tenant(request).company_id, status='done').first()
+    if not job:
+        return Response({"error": "Export not found, not finished or expired"}, status=404)
+    return exports.download(request, job)
+
+
+@query_budget(3)
+class AnalyticsView(TenantViewMixin, APIView):
     """
-    GET /api/orders/export/ — Export company’s orders (CSV)
+    GET /api/analytics/?date_from=2025-11-01&date_to=2025-11-30&group_by=day,status — Sales of the company
+     answered from the daily rollups, never from the orders table
+     group_by: any of day, product, status (default day), filters: ?status=success&product=15
+     the range defaults to the last 30 days, both ends inclusive
+
+        {
+            "date_from": "2025-11-01", "date_to": "2025-11-30", "group_by": ["day", "status"],
+            "totals": {"orders": 42, "quantity": 97, "revenue": "10350.20"},
+            "results": [{"day": "2025-11-15", "status": "pending", "orders": 3, "quantity": 7, "revenue": "812.45"}, ...]
+        }
     """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = request.query_params
+        today = timezone.localdate()
+        try:
+            date_to = parse_date(params['date_to']) if params.get('date_to') else today
+            date_from = parse_date(params['date_from']) if params.get('date_from') else date_to - timedelta(days=29)
+        except ValueError:
+            date_to = date_from = None
+        if date_from is None or date_to is None:
+            return Response({"error": "date_from and date_to must be dates, YYYY-MM-DD"}, status=400)
+        if date_from > date_to:
+            return Response({"error": "date_from is after date_to"}, status=400)
+
+        group_by = [group for group in params.get('group_by', 'day').split(',') if group]
+        unknown = set(group_by) - set(analytics.GROUPS)
+        if unknown or not group_by:
+            return Response({"error": f"group_by takes any of {', '.join(analytics.GROUPS)}"}, status=400)
+        if params.get('status') and params['status'] not in dict(Order.STATUS_CHOICES):
+            return Response({"error": "Unknown status"}, status=400)
+        if params.get('product') and not params['product'].isdigit():
+            return Response({"error": "product must be an id"}, status=400)
+
+        summary = analytics.sales_summary(
+            self.tenant.company_id, date_from, date_to, group_by,
+            status=params.get('status'), product_id=params.get('product'),
+        )
+        return Response({"date_from": date_from, "date_to": date_to, "group_by": group_by, **summary})
+
+
+class TokenView(APIView):
+    """
+    POST /api/auth/token/ — Get a signed API token for the logged in user (session or basic auth)
+     response: {"token": "..."}
+     then send it on every API call as   Authorization: Bearer <token>
+
+    DELETE /api/auth/token/ — Revoke the token this request was made with
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({"token": issue_token(request.user)}, status=201)
+
+    def delete(self, request):
+        if not isinstance(request.auth, dict):
+            return Response({"error": "Authenticate with the token you want to revoke"}, status=400)
+        revoke_token(request.auth['jti'])
+        return Response(status=204)
+
+
+@query_budget(3) # the rows are read while streaming, after the view returned
+class OrderExportView(TenantViewMixin, APIView):
+    """
+    GET /api/orders/export/?format=csv — Export company’s orders
+     format: csv (default), ndjson, arrow (Arrow IPC file) or parquet; arrow and parquet need pyarrow,
+     any other ?format= is a 400 listing these
+    the file is streamed in chunks so memory stays flat however many orders the company has.
+    for exports that take longer than a request may, queue one with POST /api/orders/exports/
+    """
+    renderer_classes = [*EXPORT_RENDERERS, JSONRenderer]
+    content_negotiation_class = ExportNegotiation
+    permission_classes = [IsAuthenticated]
 
-    user = request.user
-    orders = Order.objects.filter(company=user.company)
-    return export_order_util(orders)
+    def get(self, request):
+        fmt = request.query_params.get('format')
+        if not fmt: # from Accept, where application/json (API docs, browsers) keeps meaning csv
+            fmt = request.accepted_renderer.format if request.accepted_renderer.format in ENCODERS else 'csv'
+        try:
+            return export_order_util(Order.objects.for_tenant(self.tenant), fmt=fmt)
+        except ValueError as exc:
+            return Response({"error": str(exc)}, status=400)
 
 
 
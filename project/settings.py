@@ -42,14 +42,35 @@ DATABASES = {
         'PASSWORD': os.getenv("DB_PASSWORD", "123456"),
         'HOST': os.getenv("DB_HOST", "db"),   
         'PORT': os.getenv("DB_PORT", "3306"),
+        # persistent connections: each worker thread keeps its connection for this many seconds
+        # (0 = a new connection per request, like before) and pings it before reusing it for a new
+        # request, so a connection MySQL dropped (wait_timeout, restart) is replaced, not failed on.
+        # ASGI (SERVER_MODE=asgi) runs requests on changing threads, keep 0 there
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': os.getenv("DB_CONN_HEALTH_CHECKS", "1") == "1",
         'OPTIONS': {
             "init_command": "SET sql_mode='STRICT_TRANS_TABLES'"
         }
     }
 }
 
+# the default local-memory cache is per process, point CACHE_BACKEND/CACHE_LOCATION at a shared
+# cache (e.g. django.core.cache.backends.redis.RedisCache) when running several workers
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+PRODUCT_CATALOG_CACHE = os.getenv("PRODUCT_CATALOG_CACHE", "default")
+PRODUCT_CATALOG_TTL = int(os.getenv("PRODUCT_CATALOG_TTL", "300"))
+# the dashboard also shows today's order counts, which change without touching products
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+
 
 MIDDLEWARE = [
+    'orders.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -60,6 +81,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# per-view query count / DB / serializer / total time as Server-Timing + /api/metrics/
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "1") == "1"
+# raise instead of log when a view runs more queries than its query_budget (turn on in tests/CI)
+QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE", "0") == "1"
+# /api/metrics/ is for staff sessions, or for a scraper sending "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
 ROOT_URLCONF = 'project.urls'
 
 AUTH_USER_MODEL = 'orders.User'
@@ -111,6 +139,61 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# rows per INSERT ... ON CONFLICT/DUPLICATE KEY UPDATE of POST /api/products/import/
+PRODUCT_IMPORT_BATCH_SIZE = int(os.getenv("PRODUCT_IMPORT_BATCH_SIZE", "1000"))
+
+# how OrderMixin reserves stock:
+#   "locking"     SELECT ... FOR UPDATE the products, check, then update (default)
+#   "conditional" UPDATE ... SET stock = stock - q WHERE id = ? AND stock >= q, no prior lock (hot products)
+STOCK_RESERVATION = os.getenv("STOCK_RESERVATION", "locking")
+
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'orders.authentication.SignedTokenAuthentication', # first, so token calls never load a session
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+}
+
+API_TOKEN_MAX_AGE = int(os.getenv("API_TOKEN_MAX_AGE", str(30 * 24 * 3600)))  # seconds
+# verified tokens are cached per process; a revoked token stops working elsewhere within the TTL
+API_TOKEN_CACHE_SIZE = int(os.getenv("API_TOKEN_CACHE_SIZE", "10000"))
+API_TOKEN_CACHE_TTL = int(os.getenv("API_TOKEN_CACHE_TTL", "60"))
+
+# async ingestion (POST /api/orders/async/, served under ASGI): threads doing the DB work per
+# worker process, and how many accepted batches may wait on them before new ones get a 503
+ASYNC_INGEST_WORKERS = int(os.getenv("ASYNC_INGEST_WORKERS", "4"))
+ASYNC_INGEST_MAX_IN_FLIGHT = int(os.getenv("ASYNC_INGEST_MAX_IN_FLIGHT", "1000"))
+# run_ingest_jobs picks up batches the web process lost (restart, crash): queued ones older than
+# the grace period, and running ones older than the timeout (their transaction was rolled back)
+INGEST_JOB_GRACE_SECONDS = int(os.getenv("INGEST_JOB_GRACE_SECONDS", "30"))
+INGEST_JOB_TIMEOUT = int(os.getenv("INGEST_JOB_TIMEOUT", "600"))
+
+# Idempotency-Key on POST /api/orders/: how long a key is remembered (seconds), and the per
+# process cache that answers hot retries without a query
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 3600)))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_TTL = int(os.getenv("IDEMPOTENCY_CACHE_TTL", "300"))
+
+# background exports (POST /api/orders/exports/, written by run_export_jobs): where the files go,
+# how young an order may be and still wait for the next export (late commits), and after how
+# long a running job whose worker died is picked up again, and how long a finished file is kept
+EXPORT_ROOT = os.getenv("EXPORT_ROOT", os.path.join(BASE_DIR, 'exports'))
+EXPORT_SETTLE_SECONDS = int(os.getenv("EXPORT_SETTLE_SECONDS", "60"))
+EXPORT_JOB_TIMEOUT = int(os.getenv("EXPORT_JOB_TIMEOUT", "3600"))
+EXPORT_RETENTION_SECONDS = int(os.getenv("EXPORT_RETENTION_SECONDS", str(7 * 24 * 3600)))
+
+# admin changelists count at most this many rows exactly; beyond it an unfiltered list shows the
+# table statistics estimate and a filtered one stops paging at the limit (narrow the filters)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", "10000"))
+
+# who delivers queued order confirmations (see orders/notifications.py and dispatch_notifications)
+NOTIFICATION_SENDER = os.getenv("NOTIFICATION_SENDER", "orders.notifications.LogSender")
+# a failed notification is retried after NOTIFICATION_RETRY_DELAY seconds, doubling on every failure
+# (30s, 1m, 2m, 4m with 5 attempts); a claimed one is hidden from other workers for NOTIFICATION_CLAIM_TIMEOUT
+NOTIFICATION_RETRY_DELAY = int(os.getenv("NOTIFICATION_RETRY_DELAY", "30"))
+NOTIFICATION_CLAIM_TIMEOUT = int(os.getenv("NOTIFICATION_CLAIM_TIMEOUT", "300"))
+
 LOGGING = {
     'version':1,
     'disable_existing_loggers': False,